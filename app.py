@@ -28,6 +28,30 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_pre_ping": True,
 }
 
+# Persist each analysis in one transaction instead of committing after every step
+app.config['ANALYSIS_SINGLE_TRANSACTION'] = os.environ.get("ANALYSIS_SINGLE_TRANSACTION", "true").lower() == "true"
+
+# Generate Gemini explanations on first view of the results instead of during the analysis
+app.config['LAZY_EXPLANATIONS'] = os.environ.get("LAZY_EXPLANATIONS", "true").lower() == "true"
+
+# Number of background workers running uploaded analyses (0 runs them inside the request)
+app.config['ANALYSIS_WORKERS'] = int(os.environ.get("ANALYSIS_WORKERS", "2"))
+
+# Minutes after which an unfinished analysis is taken to have died with its worker and marked as failed
+app.config['ANALYSIS_JOB_TIMEOUT'] = int(os.environ.get("ANALYSIS_JOB_TIMEOUT", "30"))
+
+# Processes used to parse the costing sheets of a multi-sheet workbook in parallel
+app.config['SHEET_WORKERS'] = int(os.environ.get("SHEET_WORKERS", "4"))
+
+# Number of finished analyses kept for repeat uploads of the same sheet (0 disables the cache)
+app.config['RESULT_CACHE_SIZE'] = int(os.environ.get("RESULT_CACHE_SIZE", "128"))
+
+# Also write each raw upload to UPLOAD_FOLDER, named by its SHA-256, for auditing
+app.config['KEEP_UPLOADS'] = os.environ.get("KEEP_UPLOADS", "false").lower() == "true"
+
+# Supplier list kept in the manufacturer table, re-imported when it changes (more with `flask import-manufacturers`)
+app.config['MANUFACTURERS_FILE'] = os.environ.get("MANUFACTURERS_FILE", os.path.join("config", "manufacturers.csv"))
+
 # File upload configuration
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -42,5 +66,9 @@ with app.app_context():
     # Import models and routes
     import models
     import routes
+    import commands
     
     db.create_all()
+    
+    # Jobs of a previous run of this worker are gone; do not leave their sessions in progress
+    routes.analysis_queue.expire_stale()
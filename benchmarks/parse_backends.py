@@ -0,0 +1,77 @@
+"""Compare the CSV and XLSX parsing backends of SheetParser on costing-sheet shaped files.
+
+Usage: python benchmarks/parse_backends.py [--rows 5000] [--columns 60] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The parser does not depend on the Flask app, so the benchmark never touches a database
+from services.sheet_parser import (  # noqa: E402
+    CSV_ENGINES, XLSX_ENGINES, SheetParser, UploadBuffer, _engine_available
+)
+
+COUNTRIES = ['VN', 'CN', 'TW', 'DE', 'IT', 'ID']
+
+def make_sheet(rows, columns):
+    """A costing sheet with the six mapped columns padded out with filler columns"""
+    rng = np.random.default_rng(0)
+    data = {
+        'Material Name': [f"Material {i}" for i in range(rows)],
+        'Country of Origin': rng.choice(COUNTRIES, rows),
+        'HS Code': rng.choice([640610, 640620, 560900, 830810, 392690], rows),
+        'Cost per Pair': rng.uniform(0.01, 5, rows).round(4),
+        'FOB with Tooling': np.full(rows, 25.0),
+        'Manufacturer': ['Example Footwear Co'] * rows,
+    }
+    for i in range(max(columns - len(data), 0)):
+        data[f"Extra {i}"] = rng.integers(0, 1000, rows)
+    return pd.DataFrame(data)
+
+def time_parse(processor, source, repeat):
+    """Best wall-clock time of parsing source, and the number of rows parsed"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frame = processor.process_frame(source)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(frame)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--columns', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    sheet = make_sheet(args.rows, args.columns)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {'.csv': os.path.join(tmp, 'bom.csv'), '.xlsx': os.path.join(tmp, 'bom.xlsx')}
+        sheet.to_csv(paths['.csv'], index=False)
+        sheet.to_excel(paths['.xlsx'], index=False)
+
+        print(f"{args.rows} rows x {sheet.shape[1]} columns, best of {args.repeat}")
+        for ext, engines, option in (('.csv', CSV_ENGINES, 'csv_engine'), ('.xlsx', XLSX_ENGINES, 'xlsx_engine')):
+            with open(paths[ext], 'rb') as f:
+                upload = UploadBuffer(f"bom{ext}", f.read())
+
+            for engine in engines:
+                if not _engine_available(engines, engine):
+                    print(f"  {ext:<6} {engine:<10} not installed")
+                    continue
+
+                processor = SheetParser(**{option: engine})
+                for label, source in (('disk', paths[ext]), ('memory', upload)):
+                    elapsed, count = time_parse(processor, source, args.repeat)
+                    print(f"  {ext:<6} {engine:<10} {label:<7} {elapsed * 1000:9.1f} ms  ({count} rows)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+import click
+from app import app
+from services.manufacturer_import import import_manufacturers
+
+@app.cli.command('import-manufacturers')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--prune', is_flag=True, help='Remove factories an earlier import of this file listed but it no longer does.')
+def import_manufacturers_command(path, prune):
+    """Upsert a CSV or XLSX supplier list into the manufacturer table."""
+    counts = import_manufacturers(path, prune=prune)
+    click.echo(f"{counts['inserted']} inserted, {counts['updated']} updated, {counts['unchanged']} unchanged, "
+               f"{counts['removed']} removed")
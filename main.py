@@ -1,4 +1,6 @@
-from app import app
+# Sheet-parsing worker processes re-import this module as __mp_main__; they must not build the app
+if __name__ != '__mp_main__':
+    from app import app
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
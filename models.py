@@ -33,3 +33,45 @@ class MaterialAnalysis(db.Model):
     
     def __repr__(self):
         return f'<MaterialAnalysis {self.material_name}>'
+
+class WorkbookSheet(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    parent_session_id = db.Column(db.Integer, db.ForeignKey('analysis_session.id'), nullable=False, index=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('analysis_session.id'), nullable=False)
+    sheet_name = db.Column(db.String(255), nullable=False)
+    
+    parent = db.relationship('AnalysisSession', foreign_keys=[parent_session_id],
+                             backref=db.backref('sheets', lazy=True, order_by='WorkbookSheet.id'))
+    session = db.relationship('AnalysisSession', foreign_keys=[session_id])
+    
+    def __repr__(self):
+        return f'<WorkbookSheet {self.sheet_name}>'
+
+class Manufacturer(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # 'id:<normalized id>' or, for factories without an ID, 'name:<normalized name>'
+    match_key = db.Column(db.String(300), nullable=False, unique=True)
+    manufacturer_id = db.Column(db.String(100))
+    name = db.Column(db.String(255))
+    country = db.Column(db.String(100))
+    country_code = db.Column(db.String(10), index=True)
+    id_norm = db.Column(db.String(100), index=True)
+    name_norm = db.Column(db.String(255), index=True)
+    name_key = db.Column(db.String(255), index=True)  # normalize_name(): no legal suffixes or diacritics
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Manufacturer {self.name}>'
+
+class ManufacturerTrigram(db.Model):
+    """Character trigrams of Manufacturer.name_key, the posting lists for fuzzy name candidates"""
+    manufacturer_id = db.Column(db.Integer, db.ForeignKey('manufacturer.id'), primary_key=True)
+    gram = db.Column(db.String(3), primary_key=True)
+    
+    # Looked up by gram; the id rides along so candidate counting never touches the table
+    __table_args__ = (db.Index('ix_manufacturer_trigram_gram', 'gram', 'manufacturer_id'),)
+
+class ManufacturerSource(db.Model):
+    """Supplier-list files a Manufacturer row was imported from, so a re-import can drop rows it no longer lists"""
+    manufacturer_id = db.Column(db.Integer, db.ForeignKey('manufacturer.id'), primary_key=True)
+    source = db.Column(db.String(500), primary_key=True, index=True)
@@ -1,19 +1,35 @@
 import os
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from app import app, db
 from models import AnalysisSession, MaterialAnalysis
-from services.file_processor import FileProcessor
+from services.analysis_queue import AnalysisQueue
 from services.origin_analyzer import OriginAnalyzer
+from services.sheet_parser import UploadBuffer
+from services.report_store import ReportStore
+from services import export
+from services.manufacturers import resolve_many
+from services.manufacturer_import import ManufacturerFileSync
 import logging
 
 logger = logging.getLogger(__name__)
 
+analysis_queue = AnalysisQueue(app, max_workers=app.config['ANALYSIS_WORKERS'],
+                               result_cache_size=app.config['RESULT_CACHE_SIZE'],
+                               job_timeout_minutes=app.config['ANALYSIS_JOB_TIMEOUT'])
+report_store = ReportStore(os.path.join(app.config['UPLOAD_FOLDER'], 'reports'))
+manufacturer_sync = ManufacturerFileSync(app, app.config['MANUFACTURERS_FILE'])
+
 ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@app.before_request
+def sync_manufacturers():
+    # Nothing is pending in the session yet, so the import can commit; an unchanged file costs one stat()
+    manufacturer_sync.check()
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -32,33 +48,22 @@ def upload_file():
         
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            
+            # Parse straight from memory; the raw file is only written out when asked for
+            upload = UploadBuffer.from_storage(file)
+            if app.config['KEEP_UPLOADS']:
+                upload.persist(app.config['UPLOAD_FOLDER'])
             
             # Create new analysis session
             session = AnalysisSession(filename=filename)
             db.session.add(session)
             db.session.commit()
             
-            try:
-                # Process the file
-                processor = FileProcessor()
-                data = processor.process_file(filepath)
-                
-                if not data:
-                    flash('Could not process the uploaded file. Please check the format.', 'error')
-                    return redirect(url_for('upload_file'))
-                
-                # Start origin analysis
-                analyzer = OriginAnalyzer()
-                result = analyzer.analyze_origin(data, session.id)
-                
-                return redirect(url_for('view_analysis', session_id=session.id))
-                
-            except Exception as e:
-                logger.error(f"Error processing file: {str(e)}")
-                flash(f'Error processing file: {str(e)}', 'error')
-                return redirect(url_for('upload_file'))
+            # Parsing and the 7-step analysis run on the worker pool; the analysis
+            # page polls the session until the job marks it completed
+            analysis_queue.submit(session.id, upload, all_sheets=bool(request.form.get('all_sheets')))
+            
+            return redirect(url_for('view_analysis', session_id=session.id))
         else:
             flash('Invalid file type. Please upload Excel (.xlsx, .xls) or CSV files only.', 'error')
     
@@ -66,21 +71,31 @@ def upload_file():
 
 @app.route('/analysis/<int:session_id>')
 def view_analysis(session_id):
-    session = AnalysisSession.query.get_or_404(session_id)
+    session = analysis_queue.expire_if_stale(AnalysisSession.query.get_or_404(session_id))
     materials = MaterialAnalysis.query.filter_by(session_id=session_id).all()
     
     return render_template('analysis.html', session=session, materials=materials)
 
+def ensure_explanations(session):
+    """Generate the deferred Gemini explanations the first time a completed session is viewed"""
+    # Failed analyses have nothing to explain and workbook parents only summarize their sheets
+    if (session.completed and session.gemini_explanation is None
+            and session.final_result != 'error' and not session.sheets):
+        OriginAnalyzer().generate_explanations(session)
+        # Later uploads of the same sheet are cloned from the cache with these explanations
+        analysis_queue.result_cache.store_explanations(session)
+    return session
+
 @app.route('/results/<int:session_id>')
 def view_results(session_id):
-    session = AnalysisSession.query.get_or_404(session_id)
+    session = ensure_explanations(AnalysisSession.query.get_or_404(session_id))
     materials = MaterialAnalysis.query.filter_by(session_id=session_id).all()
     
     return render_template('results.html', session=session, materials=materials)
 
 @app.route('/api/analysis/<int:session_id>/status')
 def get_analysis_status(session_id):
-    session = AnalysisSession.query.get_or_404(session_id)
+    session = analysis_queue.expire_if_stale(AnalysisSession.query.get_or_404(session_id))
     return jsonify({
         'completed': session.completed,
         'steps': session.analysis_steps,
@@ -89,18 +104,74 @@ def get_analysis_status(session_id):
         'missing_fields': session.missing_fields
     })
 
+@app.route('/api/analysis/<int:session_id>/explanation', methods=['GET', 'POST'])
+def get_analysis_explanation(session_id):
+    """Stored explanations; only a POST generates missing ones, since generation calls Gemini"""
+    session = AnalysisSession.query.get_or_404(session_id)
+    if not session.completed:
+        return jsonify({'error': 'Analysis is still in progress'}), 409
+    
+    if request.method == 'POST':
+        ensure_explanations(session)
+    return jsonify({
+        'explanation': session.gemini_explanation,
+        'missing_data_analysis': session.missing_data_analysis
+    })
+
 @app.route('/download/<int:session_id>')
 def download_results(session_id):
     session = AnalysisSession.query.get_or_404(session_id)
     
-    # Generate results file
-    from services.file_processor import FileProcessor
-    processor = FileProcessor()
-    results_file = processor.generate_results_report(session_id)
+    # Reports are rebuilt only when the session changes; the version doubles as the ETag,
+    # so repeat downloads are answered with 304 Not Modified
+    report, version = report_store.open(session)
     
-    return send_file(results_file, as_attachment=True, 
+    return send_file(report, as_attachment=True, etag=version, last_modified=os.fstat(report.fileno()).st_mtime,
                     download_name=f'fta_origin_results_{session_id}.xlsx')
 
+@app.route('/api/export/<any(sessions, materials):kind>.<any(csv, ndjson):fmt>')
+def export_data(kind, fmt):
+    """Stream all sessions or material rows, filtered by ?from=&to= upload dates and ?result="""
+    try:
+        filters = export.parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid date filter: {str(e)}'}), 400
+    
+    if kind == 'sessions':
+        rows, columns = export.session_rows(filters), export.SESSION_COLUMNS
+    else:
+        rows, columns = export.material_rows(filters), export.MATERIAL_COLUMNS
+    
+    if fmt == 'csv':
+        body, mimetype = export.to_csv(rows, export.column_names(columns)), 'text/csv'
+    else:
+        body, mimetype = export.to_ndjson(rows), 'application/x-ndjson'
+    
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=fta_{kind}.{fmt}'})
+
+# Largest number of pairs accepted by one batch resolution request
+MAX_RESOLVE_BATCH = 10000
+
+@app.route('/api/manufacturers/resolve', methods=['POST'])
+def resolve_manufacturers():
+    """Resolve {"manufacturers": [{"name": ..., "manufacturer_id": ...}, ...]} against the registry"""
+    payload = request.get_json(silent=True)
+    items = payload.get('manufacturers') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return jsonify({'error': 'Expected {"manufacturers": [{"name": ..., "manufacturer_id": ...}, ...]}'}), 400
+    if len(items) > MAX_RESOLVE_BATCH:
+        return jsonify({'error': f'At most {MAX_RESOLVE_BATCH} manufacturers per request'}), 400
+    
+    pairs = [(item.get('name'), item.get('manufacturer_id')) for item in items]
+    results = resolve_many(pairs)
+    return jsonify({
+        'results': [
+            {'name': name, 'manufacturer_id': manufacturer_id, **result}
+            for (name, manufacturer_id), result in zip(pairs, results)
+        ]
+    })
+
 @app.errorhandler(413)
 def too_large(e):
     flash('File is too large. Maximum file size is 16MB.', 'error')
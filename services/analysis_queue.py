@@ -0,0 +1,163 @@
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import or_
+from models import AnalysisSession, WorkbookSheet
+from app import db
+from services.file_processor import FileProcessor
+from services.origin_analyzer import OriginAnalyzer
+from services.result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+class AnalysisQueue:
+    """Runs uploaded-file analyses on a local pool of worker threads"""
+
+    # Reason given to sessions whose job disappeared with its worker process
+    INTERRUPTED_REASON = 'The analysis was interrupted before it finished. Please upload the file again.'
+
+    def __init__(self, app, max_workers=2, result_cache_size=128, job_timeout_minutes=30):
+        self.app = app
+        self.max_workers = max_workers
+        self.job_timeout = timedelta(minutes=job_timeout_minutes)
+        self.result_cache = ResultCache(max_entries=result_cache_size)
+        self._executor = None
+        if max_workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis-worker')
+
+    def submit(self, session_id, source, all_sheets=False):
+        """Queue an analysis job, or run it inline when no workers are configured"""
+        if self._executor is None:
+            return self.run_job(session_id, source, all_sheets)
+
+        logger.info(f"Queued analysis job for session {session_id}")
+        return self._executor.submit(self._run_in_context, session_id, source, all_sheets)
+
+    def _stale_cutoff(self):
+        return datetime.utcnow() - self.job_timeout
+
+    def expire_stale(self):
+        """Mark incomplete sessions older than the job timeout as failed.
+
+        Jobs only live in the memory of the worker process that queued them, so a recycled or
+        crashed worker leaves its sessions "in progress" for good.
+        """
+        expired = (AnalysisSession.query
+                   .filter(or_(AnalysisSession.completed.is_(False), AnalysisSession.completed.is_(None)),
+                           AnalysisSession.upload_timestamp < self._stale_cutoff())
+                   .update({'completed': True, 'final_result': 'error', 'result_reason': self.INTERRUPTED_REASON},
+                           synchronize_session=False))
+        db.session.commit()
+        if expired:
+            logger.warning(f"Marked {expired} interrupted analysis sessions as failed")
+        return expired
+
+    def expire_if_stale(self, session):
+        """expire_stale() for one session, checked when its page or status is requested"""
+        if not session.completed and session.upload_timestamp < self._stale_cutoff():
+            logger.warning(f"Analysis for session {session.id} was interrupted; marking it as failed")
+            return self._fail(session.id, self.INTERRUPTED_REASON)
+        return session
+
+    def _run_in_context(self, session_id, source, all_sheets=False):
+        """Worker entry point; each job gets its own app context and DB session"""
+        with self.app.app_context():
+            try:
+                return self.run_job(session_id, source, all_sheets)
+            finally:
+                db.session.remove()
+
+    def run_job(self, session_id, source, all_sheets=False):
+        """Parse the uploaded file (a path or an UploadBuffer) and run the origin analysis for a session"""
+        try:
+            processor = FileProcessor()
+            sheet_name = None
+
+            if all_sheets:
+                sheet_names = processor.find_costing_sheets(source)
+                if len(sheet_names) > 1:
+                    return self._run_workbook(session_id, source, sheet_names)
+                if sheet_names:
+                    # The only costing sheet need not be the first one (e.g. behind a cover sheet)
+                    sheet_name = sheet_names[0]
+
+            data = processor.process_frame(source, sheet_name=sheet_name)
+
+            if data.empty:
+                return self._fail(session_id, 'Could not process the uploaded file. Please check the format.')
+
+            return self._analyze(session_id, data)
+
+        except Exception as e:
+            logger.error(f"Error processing file: {str(e)}")
+            db.session.rollback()
+            return self._fail(session_id, f'Error processing file: {str(e)}')
+
+    def _analyze(self, session_id, data):
+        """Run the 7-step analysis for one parsed sheet, reusing cached results when possible"""
+        # Identical sheets against unchanged reference data reuse the earlier result
+        cache_key = self.result_cache.make_key(data)
+        snapshot = self.result_cache.get(cache_key)
+        if snapshot is not None:
+            return self.result_cache.clone_into(cache_key, snapshot, session_id)
+
+        analyzer = OriginAnalyzer(single_transaction=self.app.config['ANALYSIS_SINGLE_TRANSACTION'],
+                                  lazy_explanations=self.app.config['LAZY_EXPLANATIONS'])
+        session = analyzer.analyze_origin(data, session_id)
+        if session.final_result != 'error':
+            self.result_cache.put(cache_key, session_id)
+        return session
+
+    def _run_workbook(self, session_id, source, sheet_names):
+        """Analyze every costing sheet as a child session of the uploaded workbook's session"""
+        parent = AnalysisSession.query.get(session_id)
+        frames = FileProcessor().process_workbook(
+            source, sheet_names, max_workers=self.app.config['SHEET_WORKERS']
+        )
+
+        for sheet_name, data in frames.items():
+            child = AnalysisSession(filename=f"{parent.filename} [{sheet_name}]")
+            db.session.add(child)
+            db.session.flush()
+            db.session.add(WorkbookSheet(parent_session_id=parent.id, session_id=child.id, sheet_name=sheet_name))
+            db.session.commit()
+
+            try:
+                if data.empty:
+                    self._fail(child.id, 'Could not process this sheet. Please check the format.')
+                else:
+                    self._analyze(child.id, data)
+            except Exception as e:
+                logger.error(f"Error analyzing sheet {sheet_name}: {str(e)}")
+                db.session.rollback()
+                self._fail(child.id, f'Error processing sheet: {str(e)}')
+
+        return self._summarize_workbook(session_id)
+
+    def _summarize_workbook(self, session_id):
+        """Roll the per-sheet determinations up into the parent session"""
+        parent = AnalysisSession.query.get(session_id)
+        results = [sheet.session.final_result for sheet in parent.sheets]
+        originating = results.count('originating')
+
+        if originating == len(results):
+            parent.final_result = 'originating'
+        elif 'non_originating' in results:
+            parent.final_result = 'non_originating'
+        else:
+            parent.final_result = 'incomplete'
+
+        parent.result_reason = f"{originating} of {len(results)} costing sheets determined as originating"
+        parent.completed = True
+        db.session.commit()
+        logger.info(f"Workbook analysis completed for session {session_id}: {parent.result_reason}")
+        return parent
+
+    def _fail(self, session_id, reason):
+        """Mark a session as finished with an error so the status poller stops"""
+        session = AnalysisSession.query.get(session_id)
+        session.final_result = 'error'
+        session.result_reason = reason
+        session.completed = True
+        db.session.commit()
+        return session
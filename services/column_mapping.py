@@ -0,0 +1,133 @@
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+logger = logging.getLogger(__name__)
+
+# Header names accepted for each standardized column, in order of preference
+COLUMN_SYNONYMS = {
+    'manufacturer': ['manufacturer', 'mfg', 'supplier', 'vendor',
+                     'manufacturer_name', 'supplier_name', 'vendor_name', 'factory'],
+    'country_of_origin': ['country_of_origin', 'country', 'origin', 'coo',
+                          'origin_country', 'country_of_orig', 'made_in'],
+    'hs_code': ['hs_code', 'hscode', 'hs', 'tariff_code',
+                'hts_code', 'hts', 'hs_no', 'tariff_no', 'commodity_code'],
+    'cost_per_pair': ['cost_per_pair', 'unit_cost', 'cost', 'price',
+                      'unit_price', 'cost_pair', 'price_per_pair'],
+    'fob_with_tooling': ['fob_with_tooling', 'fob', 'total_cost', 'fob_price', 'fob_cost'],
+    'material_name': ['material_name', 'material', 'component', 'description',
+                      'material_description', 'component_name', 'item_description']
+}
+
+# Minimum similarity for a header that matches no synonym outright
+FUZZY_CUTOFF = 0.8
+
+# Words marking a column of identifiers; a header with one only fuzzy-matches synonyms that have it too,
+# so "Supplier ID" never passes for a supplier name
+IDENTIFIER_TOKENS = {'id', 'no', 'nr', 'num', 'number', 'code', 'ref'}
+
+def canonical_header(name):
+    """Reduce a header to lowercase words joined by underscores, without units or punctuation"""
+    name = str(name).lower()
+    # Units and remarks such as "(USD)" or "[%]" do not change what a column holds
+    name = re.sub(r'\(.*?\)|\[.*?\]', ' ', name)
+    # Abbreviations such as "C.O.O." or "H.S. Code"
+    name = name.replace('.', '')
+    return re.sub(r'[^a-z0-9]+', '_', name).strip('_')
+
+def header_fingerprint(columns):
+    """Stable hash of a header row, identifying the supplier template it came from"""
+    return hashlib.sha1('\x1f'.join(map(str, columns)).encode()).hexdigest()
+
+class ColumnResolver:
+    """Maps sheet headers to the standardized columns, caching the result per header fingerprint"""
+
+    def __init__(self, synonyms=COLUMN_SYNONYMS, max_entries=256, fuzzy_cutoff=FUZZY_CUTOFF):
+        self.synonyms = synonyms
+        self.max_entries = max_entries
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, columns):
+        """Map standardized column names to the matching header names"""
+        columns = list(columns)
+        key = header_fingerprint(columns)
+
+        with self._lock:
+            mapping = self._entries.get(key)
+            if mapping is not None:
+                self._entries.move_to_end(key)
+
+        if mapping is None:
+            mapping = self._match(columns)
+            with self._lock:
+                self._entries[key] = mapping
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        else:
+            logger.debug(f"Column mapping for header {key[:12]} served from cache")
+
+        # Callers get their own copy so the cached mapping cannot be modified
+        return dict(mapping)
+
+    def probe(self, columns):
+        """Uncached exact and canonical matching only, cheap enough to test every row of a preamble"""
+        return self._match(list(columns), fuzzy=False)
+
+    def _match(self, columns, fuzzy=True):
+        """Resolve a header in three passes: exact synonym, canonical synonym, then fuzzy"""
+        mapping = {}
+        used = set()
+
+        # Exact synonyms keep the precedence the original lookup table had
+        for field, names in self.synonyms.items():
+            for name in names:
+                if name in columns and name not in used:
+                    mapping[field] = name
+                    used.add(name)
+                    break
+
+        canonical = {column: canonical_header(column) for column in columns}
+
+        for field, names in self.synonyms.items():
+            if field in mapping:
+                continue
+            for name in names:
+                column = next((c for c in columns if c not in used and canonical[c] == name), None)
+                if column is not None:
+                    mapping[field] = column
+                    used.add(column)
+                    break
+
+        if not fuzzy:
+            return mapping
+
+        # Best-scoring (field, header) pairs are assigned first so two fields never share a header
+        candidates = []
+        for field, names in self.synonyms.items():
+            if field in mapping:
+                continue
+            for column in columns:
+                if column in used or not canonical[column]:
+                    continue
+                identifiers = set(canonical[column].split('_')) & IDENTIFIER_TOKENS
+                eligible = [name for name in names if identifiers <= set(name.split('_'))]
+                if not eligible:
+                    continue
+                score = max(SequenceMatcher(None, canonical[column], name).ratio() for name in eligible)
+                if score >= self.fuzzy_cutoff:
+                    candidates.append((score, field, column))
+
+        for score, field, column in sorted(candidates, key=lambda c: c[0], reverse=True):
+            if field not in mapping and column not in used:
+                logger.info(f"Fuzzy-matched column '{column}' to {field} ({score:.2f})")
+                mapping[field] = column
+                used.add(column)
+
+        return mapping
+
+column_resolver = ColumnResolver()
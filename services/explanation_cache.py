@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class ExplanationCache:
+    """On-disk cache of LLM responses keyed by model name and a fingerprint of the prompt"""
+
+    def __init__(self, path: str, ttl_seconds: int = 7 * 24 * 3600, max_entries: int = 1000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialize_db()
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call keeps the cache safe to share across threads
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _initialize_db(self):
+        """Create the cache table if it does not exist yet"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS explanation_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    hit_count INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_explanation_cache_last_used ON explanation_cache (last_used_at)"
+            )
+
+    @staticmethod
+    def fingerprint(model: str, prompt: str, **params) -> str:
+        """Hash of the model, the generation parameters and the full prompt text"""
+        digest = hashlib.sha256()
+        digest.update(model.encode())
+        for name in sorted(params):
+            digest.update(f"\x1f{name}={params[name]}".encode())
+        digest.update(b"\x1e")
+        digest.update(prompt.encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a cached response, or None if it is missing or older than the TTL"""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT response, created_at FROM explanation_cache WHERE key = ?", (key,)
+                ).fetchone()
+
+                if row is not None and now - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM explanation_cache WHERE key = ?", (key,))
+                    row = None
+
+                if row is not None:
+                    conn.execute(
+                        "UPDATE explanation_cache SET last_used_at = ?, hit_count = hit_count + 1 WHERE key = ?",
+                        (now, key)
+                    )
+        except sqlite3.Error as e:
+            logger.error(f"Explanation cache read failed: {str(e)}")
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return row[0] if row is not None else None
+
+    def put(self, key: str, model: str, response: str):
+        """Store a response and evict the least recently used entries beyond max_entries"""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO explanation_cache (key, model, response, created_at, last_used_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, model, response, now, now)
+                )
+                conn.execute(
+                    "DELETE FROM explanation_cache WHERE key IN ("
+                    "SELECT key FROM explanation_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Explanation cache write failed: {str(e)}")
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this process and the number of stored entries"""
+        try:
+            with self._connect() as conn:
+                entries = conn.execute("SELECT COUNT(*) FROM explanation_cache").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+            }
@@ -0,0 +1,101 @@
+import csv
+import io
+import json
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from models import AnalysisSession, MaterialAnalysis
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_CHUNK_SIZE = 1000
+
+SESSION_COLUMNS = [
+    AnalysisSession.id, AnalysisSession.filename, AnalysisSession.upload_timestamp,
+    AnalysisSession.manufacturer, AnalysisSession.final_hs_code, AnalysisSession.final_result,
+    AnalysisSession.result_reason, AnalysisSession.missing_fields, AnalysisSession.completed
+]
+MATERIAL_COLUMNS = [
+    MaterialAnalysis.session_id, AnalysisSession.filename, AnalysisSession.upload_timestamp,
+    AnalysisSession.final_result, MaterialAnalysis.id.label('material_id'), MaterialAnalysis.material_name,
+    MaterialAnalysis.country_of_origin, MaterialAnalysis.hs_code, MaterialAnalysis.cost_per_pair,
+    MaterialAnalysis.is_problematic, MaterialAnalysis.analysis_notes
+]
+
+def _parse_bound(value, end=False):
+    """Parse an ISO date or datetime; a bare end date includes the whole of that day"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and 'T' not in value and ' ' not in value:
+        parsed += timedelta(days=1)
+    return parsed
+
+def parse_filters(args):
+    """Read the date-range and result filters from request arguments, raising ValueError on bad input"""
+    return {
+        'from': _parse_bound(args.get('from')),
+        'to': _parse_bound(args.get('to'), end=True),
+        'results': args.getlist('result'),
+    }
+
+def _filtered(query, filters):
+    """Apply the upload-date range and final-result filters to a query over AnalysisSession"""
+    if filters['from'] is not None:
+        query = query.where(AnalysisSession.upload_timestamp >= filters['from'])
+    if filters['to'] is not None:
+        query = query.where(AnalysisSession.upload_timestamp < filters['to'])
+    if filters['results']:
+        query = query.where(AnalysisSession.final_result.in_(filters['results']))
+    return query
+
+def _stream(query):
+    """Yield result rows as dicts, fetched in chunks through a server-side cursor"""
+    result = db.session.execute(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+    for row in result:
+        yield dict(row._mapping)
+
+def session_rows(filters):
+    """All analysis sessions matching the filters, oldest first"""
+    query = select(*SESSION_COLUMNS).order_by(AnalysisSession.id)
+    return _stream(_filtered(query, filters))
+
+def material_rows(filters):
+    """Material rows of the sessions matching the filters, with the fields of their session"""
+    query = (select(*MATERIAL_COLUMNS)
+             .join(AnalysisSession, MaterialAnalysis.session_id == AnalysisSession.id)
+             .order_by(MaterialAnalysis.session_id, MaterialAnalysis.id))
+    return _stream(_filtered(query, filters))
+
+def column_names(columns):
+    return [column.key for column in columns]
+
+def _text(value):
+    """Value of a CSV cell; JSON columns are written as JSON and timestamps in ISO format"""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def to_csv(rows, columns):
+    """Yield CSV text for rows, a header line first and then one chunk per EXPORT_CHUNK_SIZE rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_text(row[column]) for column in columns])
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+def to_ndjson(rows):
+    """Yield one JSON document per row"""
+    for row in rows:
+        yield json.dumps(row, default=_text) + '\n'
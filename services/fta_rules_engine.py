@@ -1,12 +1,22 @@
 import json
 import os
+import re
 import logging
 
 logger = logging.getLogger(__name__)
 
+class _HSPrefixNode:
+    """One digit of the compiled HS-prefix trie"""
+    __slots__ = ('children', 'entry')
+    
+    def __init__(self):
+        self.children = {}
+        self.entry = None
+
 class FTARulesEngine:
     def __init__(self):
         self.fta_rules = self._load_fta_rules()
+        self.hs_index = self._compile_hs_index(self.fta_rules)
     
     def _load_fta_rules(self):
         """Load FTA rules from configuration file"""
@@ -45,6 +55,94 @@ class FTARulesEngine:
             }
         }
     
+    def _compile_hs_index(self, fta_rules):
+        """Compile the rules document into a longest-prefix trie keyed by HS digits"""
+        root = _HSPrefixNode()
+        
+        # Flat documents (and the built-in defaults) key rules directly by HS prefix
+        for key, value in fta_rules.items():
+            if key.isdigit() and isinstance(value, dict):
+                self._insert_prefix(root, key, dict(value))
+        
+        # Agreement documents nest rules as chapters -> sections -> hs_scope -> rules
+        for chapter in fta_rules.get('chapters', []):
+            chapter_code = str(chapter.get('chapter_code', '')).strip()
+            for section in chapter.get('sections', []):
+                entry = {
+                    'description': f"Chapter {chapter_code} ({chapter.get('title', '')}) - {section.get('name', '')}",
+                    'chapter': chapter_code,
+                    'sections': [section.get('name', '')],
+                    'rules': [self._describe_rule(rule) for rule in section.get('rules', [])],
+                    'rule_ids': [rule.get('rule_id') for rule in section.get('rules', [])],
+                }
+                threshold = self._section_threshold(section)
+                if threshold is not None:
+                    entry['threshold'] = threshold
+                
+                for prefix in self._section_prefixes(chapter_code, section):
+                    self._insert_prefix(root, prefix, entry)
+        
+        return root
+    
+    def _section_prefixes(self, chapter_code, section):
+        """HS prefixes a section applies to: its hs_scope, headings named in its title, or the chapter"""
+        prefixes = []
+        for scope in section.get('hs_scope', []):
+            code = scope.get('hs_code', '') if isinstance(scope, dict) else scope
+            code = str(code).replace(' ', '').replace('.', '')
+            if code.isdigit():
+                prefixes.append(code)
+        
+        if not prefixes:
+            # e.g. "Heading 6307" or "Headings 6202, 6204, 6206, 6209 & 6211"
+            prefixes = [code for code in re.findall(r'\b\d{4,10}\b', section.get('name', ''))
+                        if code.startswith(chapter_code)]
+        
+        return prefixes or ([chapter_code] if chapter_code.isdigit() else [])
+    
+    def _insert_prefix(self, root, prefix, entry):
+        """Attach an entry to the trie node for a prefix, merging sections that share it"""
+        node = root
+        for digit in prefix:
+            node = node.children.setdefault(digit, _HSPrefixNode())
+        
+        if node.entry is None:
+            node.entry = entry
+            return
+        
+        merged = dict(node.entry)
+        merged['sections'] = merged.get('sections', []) + entry.get('sections', [])
+        merged['rules'] = merged.get('rules', []) + entry.get('rules', [])
+        merged['rule_ids'] = merged.get('rule_ids', []) + entry.get('rule_ids', [])
+        if 'threshold' in entry:
+            merged['threshold'] = min(merged.get('threshold', entry['threshold']), entry['threshold'])
+        node.entry = merged
+    
+    def _section_threshold(self, section):
+        """Most restrictive percentage threshold across a section's rules"""
+        limits = [
+            threshold['limit']
+            for rule in section.get('rules', [])
+            for threshold in rule.get('thresholds', [])
+            if threshold.get('unit') == '%' and threshold.get('limit') is not None
+        ]
+        return min(limits) if limits else None
+    
+    def _describe_rule(self, rule):
+        """Render a structured rule as a single readable sentence"""
+        if rule.get('commentary'):
+            return rule['commentary']
+        
+        parts = [p['description'] for p in rule.get('main_processes', []) if p.get('description')]
+        for threshold in rule.get('thresholds', []):
+            parts.append(
+                f"Non-originating materials {threshold.get('comparator', '≤')} "
+                f"{threshold.get('limit')}{threshold.get('unit', '')} of the {threshold.get('basis', 'price')}"
+            )
+        parts.extend(c['description'] for c in rule.get('exception_clauses', []) if c.get('description'))
+        
+        return '; '.join(parts) or f"Rule {rule.get('rule_id', 'unknown')}"
+    
     def get_rules_for_hs_code(self, hs_code):
         """Get applicable FTA rules for specific HS code"""
         if not hs_code:
@@ -52,14 +150,18 @@ class FTARulesEngine:
         
         hs_code = str(hs_code).replace(' ', '').replace('.', '')
         
-        # Try exact match first
-        if hs_code in self.fta_rules:
-            return self.fta_rules[hs_code]
+        # Walk the trie one digit at a time, keeping the longest matching prefix
+        node = self.hs_index
+        match = None
+        for digit in hs_code:
+            node = node.children.get(digit)
+            if node is None:
+                break
+            if node.entry is not None:
+                match = node.entry
         
-        # Try heading match
-        heading = hs_code[:4] if len(hs_code) >= 4 else hs_code
-        if heading in self.fta_rules:
-            return self.fta_rules[heading]
+        if match is not None:
+            return match
         
         # Return default rules
         return self.fta_rules.get('default', {})
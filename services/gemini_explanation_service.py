@@ -12,12 +12,18 @@ except ImportError:
     genai = None
     types = None
 
+from services.explanation_cache import ExplanationCache
+
 logger = logging.getLogger(__name__)
 
+GEMINI_MODEL = "gemini-2.5-flash"
+
 class GeminiExplanationService:
     def __init__(self):
         self.client = None
+        self.cache = None
         self._initialize_client()
+        self._initialize_cache()
     
     def _initialize_client(self):
         """Initialize Gemini client if API key is available"""
@@ -37,6 +43,48 @@ class GeminiExplanationService:
         except Exception as e:
             logger.error(f"Failed to initialize Gemini client: {str(e)}")
     
+    def _initialize_cache(self):
+        """Open the persistent response cache; generation still works without it"""
+        try:
+            self.cache = ExplanationCache(
+                path=os.environ.get("EXPLANATION_CACHE_PATH", os.path.join("instance", "explanation_cache.db")),
+                ttl_seconds=int(os.environ.get("EXPLANATION_CACHE_TTL", str(7 * 24 * 3600))),
+                max_entries=int(os.environ.get("EXPLANATION_CACHE_SIZE", "1000"))
+            )
+        except Exception as e:
+            logger.error(f"Failed to initialize explanation cache: {str(e)}")
+    
+    def _generate_content(self, prompt: str, max_output_tokens: int, temperature: float = 0.3) -> Optional[str]:
+        """Call Gemini for a prompt, serving identical prompts from the response cache"""
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.fingerprint(
+                GEMINI_MODEL, prompt, max_output_tokens=max_output_tokens, temperature=temperature
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                # The in-process counters are enough for the log line; stats() would query the table
+                logger.info(f"Explanation cache hit ({self.cache.hits} hits, {self.cache.misses} misses)")
+                return cached
+        
+        config = None
+        if types is not None:
+            config = types.GenerateContentConfig(
+                max_output_tokens=max_output_tokens,
+                temperature=temperature
+            )
+        
+        response = self.client.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=config
+        )
+        
+        text = response.text.strip() if response.text else None
+        if text and cache_key is not None:
+            self.cache.put(cache_key, GEMINI_MODEL, text)
+        return text
+    
     def is_available(self) -> bool:
         """Check if Gemini service is available"""
         return self.client is not None
@@ -58,21 +106,10 @@ class GeminiExplanationService:
         try:
             prompt = self._build_explanation_prompt(session_data, materials_data)
             
-            config = None
-            if types is not None:
-                config = types.GenerateContentConfig(
-                    max_output_tokens=800,
-                    temperature=0.3
-                )
-            
-            response = self.client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=prompt,
-                config=config
-            )
+            explanation = self._generate_content(prompt, max_output_tokens=800)
             
-            if response.text:
-                return response.text.strip()
+            if explanation:
+                return explanation
             else:
                 logger.warning("Empty response from Gemini")
                 return self._generate_fallback_explanation(session_data, materials_data)
@@ -228,20 +265,7 @@ Provide a brief analysis (2-3 paragraphs) covering:
 Keep the tone professional and actionable for business users.
 """
             
-            config = None
-            if types is not None:
-                config = types.GenerateContentConfig(
-                    max_output_tokens=400,
-                    temperature=0.3
-                )
-            
-            response = self.client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=prompt,
-                config=config
-            )
-            
-            return response.text.strip() if response.text else None
+            return self._generate_content(prompt, max_output_tokens=400)
             
         except Exception as e:
             logger.error(f"Error generating missing data analysis: {str(e)}")
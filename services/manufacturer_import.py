@@ -0,0 +1,171 @@
+import logging
+import os
+from datetime import datetime
+from sqlalchemy import insert, update, select, delete, exists
+from sqlalchemy.exc import IntegrityError
+from models import Manufacturer, ManufacturerTrigram, ManufacturerSource
+from app import db
+from services.manufacturers import read_records, match_key, index_values, chunked, FileWatcher
+from services.name_matching import trigrams
+
+logger = logging.getLogger(__name__)
+
+# Rows written per executemany
+IMPORT_CHUNK_SIZE = 1000
+
+FIELDS = ['manufacturer_id', 'name', 'country', 'country_code']
+
+def _row_values(record, now):
+    return {
+        'match_key': match_key(record),
+        'manufacturer_id': record.manufacturer_id,
+        'name': record.name,
+        'country': record.country,
+        'country_code': record.country_code,
+        'updated_at': now,
+        **index_values(record),
+    }
+
+def import_manufacturers(path, prune=False):
+    """Upsert a CSV/XLSX supplier list into the Manufacturer table, touching only new or changed rows.
+
+    Every row the file lists is recorded as coming from it; with prune, rows it imported before but
+    no longer lists are deleted, unless another imported file still lists them.
+    """
+    records = read_records(path)
+    source = os.path.abspath(path)
+    existing = {
+        key: (row_id, values)
+        for row_id, key, *values in db.session.execute(
+            select(Manufacturer.id, Manufacturer.match_key, *(getattr(Manufacturer, f) for f in FIELDS))
+        )
+    }
+
+    now = datetime.utcnow()
+    inserts, updates, unchanged = [], [], 0
+    seen = set()
+    for record in records:
+        key = match_key(record)
+        # Earlier rows win within one file, as they do in the in-memory registry
+        if key in seen:
+            continue
+        seen.add(key)
+
+        current = existing.get(key)
+        if current is None:
+            inserts.append(_row_values(record, now))
+        elif current[1] != [getattr(record, f) for f in FIELDS]:
+            updates.append(dict(_row_values(record, now), id=current[0]))
+        else:
+            unchanged += 1
+
+    try:
+        for start in range(0, len(inserts), IMPORT_CHUNK_SIZE):
+            db.session.execute(insert(Manufacturer), inserts[start:start + IMPORT_CHUNK_SIZE])
+        for start in range(0, len(updates), IMPORT_CHUNK_SIZE):
+            db.session.execute(update(Manufacturer), updates[start:start + IMPORT_CHUNK_SIZE])
+
+        ids = _ids_by_key(seen)
+        _index_names([ids[row['match_key']] for row in inserts + updates])
+        _link_source(source, set(ids.values()))
+        removed = _prune(source, set(ids.values())) if prune else 0
+        db.session.commit()
+    except IntegrityError:
+        # Another worker imported the same rows first; its result stands
+        db.session.rollback()
+        logger.warning(f"Manufacturer import of {path} raced with another import; skipped")
+        return {'inserted': 0, 'updated': 0, 'unchanged': len(seen), 'removed': 0}
+
+    counts = {'inserted': len(inserts), 'updated': len(updates), 'unchanged': unchanged, 'removed': removed}
+    logger.info(f"Imported manufacturers from {path}: {counts}")
+    return counts
+
+def _ids_by_key(keys):
+    ids = {}
+    for chunk in chunked(keys):
+        ids.update(db.session.execute(
+            select(Manufacturer.match_key, Manufacturer.id).where(Manufacturer.match_key.in_(chunk))
+        ).all())
+    return ids
+
+def _index_names(row_ids):
+    """Rewrite the trigram postings of changed rows, and of any row that has none yet"""
+    unindexed = db.session.scalars(select(Manufacturer.id).where(
+        ~exists().where(ManufacturerTrigram.manufacturer_id == Manufacturer.id)
+    ))
+    row_ids = set(row_ids) | set(unindexed)
+    for chunk in chunked(row_ids):
+        db.session.execute(delete(ManufacturerTrigram).where(ManufacturerTrigram.manufacturer_id.in_(chunk)))
+        rows = db.session.execute(select(Manufacturer.id, Manufacturer.name_key).where(Manufacturer.id.in_(chunk)))
+        postings = [
+            {'manufacturer_id': row_id, 'gram': gram}
+            for row_id, name_key in rows if name_key
+            for gram in trigrams(name_key)
+        ]
+        if postings:
+            db.session.execute(insert(ManufacturerTrigram), postings)
+
+def _link_source(source, row_ids):
+    linked = set(db.session.scalars(
+        select(ManufacturerSource.manufacturer_id).where(ManufacturerSource.source == source)
+    ))
+    links = [{'manufacturer_id': row_id, 'source': source} for row_id in row_ids - linked]
+    for start in range(0, len(links), IMPORT_CHUNK_SIZE):
+        db.session.execute(insert(ManufacturerSource), links[start:start + IMPORT_CHUNK_SIZE])
+
+def _prune(source, row_ids):
+    """Drop the rows source no longer lists, once no other imported file lists them either"""
+    dropped = set(db.session.scalars(
+        select(ManufacturerSource.manufacturer_id).where(ManufacturerSource.source == source)
+    )) - row_ids
+    if not dropped:
+        return 0
+
+    removed = 0
+    for chunk in chunked(dropped):
+        db.session.execute(delete(ManufacturerSource).where(
+            ManufacturerSource.source == source, ManufacturerSource.manufacturer_id.in_(chunk)
+        ))
+        orphans = list(db.session.scalars(select(Manufacturer.id).where(
+            Manufacturer.id.in_(chunk),
+            ~exists().where(ManufacturerSource.manufacturer_id == Manufacturer.id)
+        )))
+        if orphans:
+            db.session.execute(delete(ManufacturerTrigram).where(ManufacturerTrigram.manufacturer_id.in_(orphans)))
+            db.session.execute(delete(Manufacturer).where(Manufacturer.id.in_(orphans)))
+            removed += len(orphans)
+    return removed
+
+class ManufacturerFileSync(FileWatcher):
+    """Keeps the Manufacturer table in step with a supplier-list file, re-importing it when it changes.
+
+    Re-imports prune: a factory removed from the file stops matching.
+
+    Background imports get their own app context and session; lookups keep reading the table meanwhile.
+    """
+
+    thread_name = "manufacturers-import"
+
+    def __init__(self, app, path):
+        super().__init__(path)
+        self.app = app
+
+    def check(self):
+        """Import the file if it changed since the last import; call with no pending writes in the session"""
+        self.current()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            return import_manufacturers(self.path, prune=True)
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _reload_in_background(self, stamp):
+        with self.app.app_context():
+            try:
+                super()._reload_in_background(stamp)
+            finally:
+                db.session.remove()
@@ -1,58 +1,374 @@
-from functools import lru_cache
-from pathlib import Path
-import pandas as pd
-
-VN_NAMES = {"vietnam", "viet nam", "socialist republic of viet nam"}
-VN_CODES = {"vn"}
-
-def _norm(s):
-    return (str(s) if s is not None else "").strip().lower()
-
-@lru_cache(maxsize=1)
-def load(csv_path="config/manufacturers.csv"):
-    p = Path(csv_path)
-    if not p.exists():
-        # Empty DF with expected structure
-        return pd.DataFrame(columns=["manufacturer_id", "name", "country", "country_code",
-                                     "_id_norm", "_name_norm", "_country_norm", "_cc_norm"])
-
-    df = pd.read_csv(p, dtype=str).fillna("")
-
-    # >>> RENAME PATCH (map your headers to expected names) <<<
-    df = df.rename(columns={
-        "Manufacturers: name": "name",
-        "Country of location": "country",
-        # keep others as-is; we don't need Product Category or Location
-    })
-
-    # Ensure all expected source cols exist
-    for col in ["manufacturer_id", "name", "country", "country_code"]:
-        if col not in df.columns:
-            df[col] = ""
-
-    # Always build helper columns
-    df["_id_norm"] = df["manufacturer_id"].map(_norm)
-    df["_name_norm"] = df["name"].map(_norm)
-    df["_country_norm"] = df["country"].map(_norm)
-    df["_cc_norm"] = df["country_code"].map(_norm)
-
-    return df
-
-def lookup(name="", manufacturer_id="", csv_path="config/manufacturers.csv"):
-    df = load(csv_path)
-    name_n = _norm(name)
-    id_n = _norm(manufacturer_id)
-
-    cand = df
-    if id_n:
-        cand = cand[cand["_id_norm"] == id_n]
-    if name_n and cand.empty:
-        cand = df[df["_name_norm"] == name_n]
-
-    if cand.empty:
-        return {"found": False, "is_vietnam": False, "match": None}
-
-    row = cand.iloc[0]
-    is_vn = (row["_cc_norm"] in VN_CODES) or (row["_country_norm"] in VN_NAMES)
-    match = row.drop(labels=[c for c in row.index if c.startswith("_")]).to_dict()
-    return {"found": True, "is_vietnam": is_vn, "match": match}
+import csv
+import hashlib
+import heapq
+import logging
+import os
+import threading
+from collections import Counter, defaultdict, namedtuple
+from itertools import chain
+from pathlib import Path
+from openpyxl import load_workbook
+from sqlalchemy import func
+from models import Manufacturer, ManufacturerTrigram
+from app import db
+from services.name_matching import (
+    NameIndex, normalize_name, trigrams, MIN_SCORE, MAX_PROBE_GRAMS, MAX_CANDIDATES
+)
+
+logger = logging.getLogger(__name__)
+
+VN_NAMES = {"vietnam", "viet nam", "socialist republic of viet nam"}
+VN_CODES = {"vn"}
+
+# Values per IN (...) query, well below SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+# Header names used by supplier master files, mapped to the registry fields
+COLUMN_ALIASES = {
+    "manufacturer_id": "manufacturer_id",
+    "name": "name",
+    "manufacturers": "name",
+    "manufacturers: name": "name",
+    "country": "country",
+    "country of location": "country",
+    "country_code": "country_code",
+    "location": "country_code",
+}
+
+# One compact tuple per factory; the dict indexes below only hold positions into these
+ManufacturerRecord = namedtuple("ManufacturerRecord", ["manufacturer_id", "name", "country", "country_code"])
+
+def _norm(s):
+    return (str(s) if s is not None else "").strip().lower()
+
+def is_vietnam(record):
+    return _norm(record.country_code) in VN_CODES or _norm(record.country) in VN_NAMES
+
+def match_key(record):
+    """Identity of a supplier-list row: its ID when it has one, else its name"""
+    id_n = _norm(record.manufacturer_id)
+    return f"id:{id_n}" if id_n else f"name:{_norm(record.name)}"
+
+def index_values(record):
+    """Normalized lookup columns of the Manufacturer table for a record"""
+    return {
+        "id_norm": _norm(record.manufacturer_id),
+        "name_norm": _norm(record.name),
+        "name_key": normalize_name(record.name),
+    }
+
+def read_records(path):
+    """Rows of a supplier list (CSV or XLSX, first row as header) as ManufacturerRecords"""
+    p = Path(path)
+    if p.suffix.lower() == ".xlsx":
+        wb = load_workbook(p, read_only=True, data_only=True)
+        try:
+            rows = [["" if v is None else str(v) for v in row] for row in wb.worksheets[0].iter_rows(values_only=True)]
+        finally:
+            wb.close()
+    else:
+        with p.open(newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.reader(f))
+
+    if not rows:
+        return []
+
+    header = [COLUMN_ALIASES.get(_norm(h)) for h in rows[0]]
+    records = []
+    for row in rows[1:]:
+        values = dict.fromkeys(ManufacturerRecord._fields, "")
+        for field, value in zip(header, row):
+            if field and not values[field]:
+                values[field] = value.strip()
+        if values["name"] or values["manufacturer_id"]:
+            records.append(ManufacturerRecord(**values))
+    return records
+
+class ManufacturerRegistry:
+    """Manufacturer master compiled into dict indexes on normalized ID and name, plus a fuzzy name index"""
+
+    def __init__(self, records):
+        self.records = tuple(records)
+        self.by_id = {}
+        self.by_name = {}
+        # The first row wins for duplicate keys, as the old DataFrame lookup took iloc[0]
+        for idx, record in enumerate(self.records):
+            id_n = _norm(record.manufacturer_id)
+            name_n = _norm(record.name)
+            if id_n:
+                self.by_id.setdefault(id_n, idx)
+            if name_n:
+                self.by_name.setdefault(name_n, idx)
+        self.names = NameIndex(record.name for record in self.records)
+
+    @classmethod
+    def from_file(cls, path):
+        """Read a supplier list; missing files give an empty registry"""
+        if not Path(path).exists():
+            return cls([])
+        return cls(read_records(path))
+
+    def __len__(self):
+        return len(self.records)
+
+    def find(self, name="", manufacturer_id=""):
+        """The matching record (by id, then exact name, then fuzzy name) and its confidence, or (None, 0.0)"""
+        id_n = _norm(manufacturer_id)
+        name_n = _norm(name)
+
+        idx = self.by_id.get(id_n) if id_n else None
+        if idx is None and name_n:
+            idx = self.by_name.get(name_n)
+        if idx is not None:
+            return self.records[idx], 1.0
+
+        # Spelling variants such as "Co Ltd" for "Company Limited" or "Vietnam" for "Viet Nam"
+        hit = self.names.search(name) if name_n else None
+        if hit is None:
+            return None, 0.0
+        return self.records[hit[0]], hit[1]
+
+    def lookup(self, name="", manufacturer_id=""):
+        return _lookup_result(*self.find(name=name, manufacturer_id=manufacturer_id))
+
+def _file_stamp(path):
+    """(mtime, size) of a file, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _file_digest(path):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+class FileWatcher:
+    """Runs load() on a file whenever its content changes, keeping the last result.
+
+    The first load runs inline, since there is nothing to serve before it; later ones run on a
+    background thread while callers keep the previous result, swapped in by a single assignment.
+    A touched but unchanged file (same digest) is not loaded again, and a failed load is retried
+    only once the file changes again.
+    """
+
+    thread_name = "file-reload"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loading = False
+        self._current = None  # (stamp, digest, result)
+
+    def load(self):
+        raise NotImplementedError
+
+    def current(self):
+        """The result for the file's current content, or the previous one while a reload runs"""
+        current = self._current
+        if current is None:
+            with self._lock:
+                if self._current is None:
+                    self._reload(_file_stamp(self.path))
+                return self._current[2]
+
+        stamp = _file_stamp(self.path)
+        if stamp != current[0]:
+            self._schedule_reload(stamp)
+        return current[2]
+
+    def _schedule_reload(self, stamp):
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._reload_in_background, args=(stamp,), name=self.thread_name, daemon=True).start()
+
+    def _reload_in_background(self, stamp):
+        try:
+            self._reload(stamp)
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def _reload(self, stamp):
+        digest = _file_digest(self.path)
+        previous = self._current
+        if previous is not None and digest is not None and digest == previous[1]:
+            self._current = (stamp, digest, previous[2])
+            return
+        try:
+            result = self.load()
+        except Exception as e:
+            logger.error(f"Failed to load {self.path}: {str(e)}")
+            result, digest = (previous[2] if previous is not None else None), None
+        self._current = (stamp, digest, result)
+
+class RegistryLoader(FileWatcher):
+    """The in-memory registry of a supplier-list file, for lookups given an explicit csv_path.
+
+    The app itself resolves against the Manufacturer table, kept in step with its file by
+    services.manufacturer_import.ManufacturerFileSync on the same FileWatcher mechanism.
+    """
+
+    thread_name = "manufacturers-reload"
+
+    def load(self):
+        registry = ManufacturerRegistry.from_file(self.path)
+        logger.info(f"Loaded manufacturer registry from {self.path} ({len(registry)} entries)")
+        return registry
+
+    def get(self):
+        return self.current() or ManufacturerRegistry([])
+
+_loaders = {}
+_loaders_lock = threading.Lock()
+
+def load(csv_path="config/manufacturers.csv"):
+    """Current registry for a master file; each path keeps its own loader"""
+    loader = _loaders.get(csv_path)
+    if loader is None:
+        with _loaders_lock:
+            loader = _loaders.setdefault(csv_path, RegistryLoader(csv_path))
+    return loader.get()
+
+def _lookup_result(record, confidence):
+    if record is None:
+        return {"found": False, "is_vietnam": False, "match": None, "confidence": 0.0}
+    match = {field: getattr(record, field) for field in ManufacturerRecord._fields}
+    return {"found": True, "is_vietnam": is_vietnam(record), "match": match, "confidence": round(confidence, 3)}
+
+def chunked(values, size=LOOKUP_CHUNK_SIZE):
+    """Lists of at most size values, one per IN (...) query"""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def find_in_table(name="", manufacturer_id=""):
+    """Match against the Manufacturer table: id, exact name and normalized name through its indexes, then fuzzy"""
+    id_n = _norm(manufacturer_id)
+    name_n = _norm(name)
+    base = Manufacturer.query.order_by(Manufacturer.id)
+
+    row = base.filter_by(id_norm=id_n).first() if id_n else None
+    if row is None and name_n:
+        row = base.filter_by(name_norm=name_n).first()
+    key = normalize_name(name) if name_n else ""
+    if row is None and key:
+        row = base.filter_by(name_key=key).first()
+    if row is not None:
+        return row, 1.0
+
+    hit = _fuzzy_matches([name]).get(name)
+    if hit is None:
+        return None, 0.0
+    return db.session.get(Manufacturer, hit[0]), hit[1]
+
+def _fuzzy_matches(names):
+    """(row id, score) of the most similar table name for each name that has one above MIN_SCORE.
+
+    The same retrieval as NameIndex.search, run against the ManufacturerTrigram postings: the rarest
+    query grams collect candidates, and the MAX_CANDIDATES sharing most of them are scored. A whole
+    batch of names costs a few chunked queries, and nothing per name stays in memory.
+    """
+    grams = {}
+    for name in names:
+        key = normalize_name(name)
+        if key:
+            grams[name] = trigrams(key)
+    if not grams:
+        return {}
+
+    gram = ManufacturerTrigram.gram
+    frequency = {}
+    for chunk in chunked(set().union(*grams.values())):
+        frequency.update(db.session.query(gram, func.count()).filter(gram.in_(chunk)).group_by(gram))
+
+    probes = {
+        name: sorted((g for g in query_grams if g in frequency), key=lambda g: (frequency[g], g))[:MAX_PROBE_GRAMS]
+        for name, query_grams in grams.items()
+    }
+    postings = defaultdict(list)
+    for chunk in chunked(set().union(*probes.values())):
+        for posted, row_id in db.session.query(gram, ManufacturerTrigram.manufacturer_id).filter(gram.in_(chunk)):
+            postings[posted].append(row_id)
+
+    candidates = {}
+    for name, probe in probes.items():
+        counts = Counter(chain.from_iterable(postings[g] for g in probe))
+        top = heapq.nsmallest(MAX_CANDIDATES, counts.items(), key=lambda item: (-item[1], item[0]))
+        candidates[name] = [row_id for row_id, _ in top]
+
+    name_grams = {}
+    for chunk in chunked(set().union(*candidates.values())):
+        for row_id, name_key in db.session.query(Manufacturer.id, Manufacturer.name_key).filter(Manufacturer.id.in_(chunk)):
+            name_grams[row_id] = trigrams(name_key)
+
+    matches = {}
+    for name, row_ids in candidates.items():
+        query_grams = grams[name]
+        best, best_score = None, 0.0
+        for row_id in row_ids:
+            other = name_grams[row_id]
+            score = 2 * len(query_grams & other) / (len(query_grams) + len(other))
+            if score > best_score:
+                best, best_score = row_id, score
+        if best is not None and best_score >= MIN_SCORE:
+            matches[name] = (best, best_score)
+    return matches
+
+def _rows_by(column, values):
+    """First Manufacturer row for each value of an indexed column, fetched with a few IN queries"""
+    found = {}
+    for chunk in chunked(values):
+        for row in Manufacturer.query.filter(column.in_(chunk)).order_by(Manufacturer.id):
+            found.setdefault(getattr(row, column.key), row)
+    return found
+
+def find_many_in_table(pairs):
+    """(row, confidence) for each (name, manufacturer_id) pair, resolving the whole batch with a few chunked queries"""
+    unique = list(dict.fromkeys(pairs))
+    by_id = _rows_by(Manufacturer.id_norm, {_norm(m) for _, m in unique if _norm(m)})
+    by_name = _rows_by(Manufacturer.name_norm, {_norm(n) for n, _ in unique if _norm(n)})
+    keys = {n: normalize_name(n) for n, _ in unique if _norm(n)}
+    by_key = _rows_by(Manufacturer.name_key, {k for k in keys.values() if k})
+
+    resolved = {}
+    unmatched = []
+    for name, manufacturer_id in unique:
+        row = by_id.get(_norm(manufacturer_id)) or by_name.get(_norm(name)) or by_key.get(keys.get(name))
+        if row is not None:
+            resolved[(name, manufacturer_id)] = (row, 1.0)
+        else:
+            unmatched.append((name, manufacturer_id))
+
+    # Names without an exact match are fuzzy-matched together, then their rows fetched together
+    hits = _fuzzy_matches({name for name, _ in unmatched if keys.get(name)})
+    by_row_id = _rows_by(Manufacturer.id, {row_id for row_id, _ in hits.values()})
+
+    for name, manufacturer_id in unmatched:
+        hit = hits.get(name)
+        resolved[(name, manufacturer_id)] = (by_row_id[hit[0]], hit[1]) if hit else (None, 0.0)
+    return [resolved[pair] for pair in pairs]
+
+def table_version():
+    """Row count and last update of the Manufacturer table, for keying cached analysis results"""
+    count, updated = db.session.query(func.count(Manufacturer.id), func.max(Manufacturer.updated_at)).one()
+    return f"{count}@{updated}"
+
+def lookup(name="", manufacturer_id="", csv_path=None):
+    """Resolve a manufacturer in the Manufacturer table, or in a supplier-list file when csv_path is given"""
+    if csv_path is not None:
+        return load(csv_path).lookup(name=name, manufacturer_id=manufacturer_id)
+    return _lookup_result(*find_in_table(name=name, manufacturer_id=manufacturer_id))
+
+def resolve_many(pairs, csv_path=None):
+    """lookup() for many (name, manufacturer_id) pairs at once, results in input order"""
+    pairs = [(str(name or ""), str(manufacturer_id or "")) for name, manufacturer_id in pairs]
+    if csv_path is not None:
+        registry = load(csv_path)
+        return [registry.lookup(name=name, manufacturer_id=manufacturer_id) for name, manufacturer_id in pairs]
+    return [_lookup_result(*found) for found in find_many_in_table(pairs)]
@@ -0,0 +1,99 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+# Legal forms dropped from company names, as whole tokens or token sequences
+LEGAL_PHRASES = [
+    ("joint", "stock", "company"), ("joint", "stock"), ("company", "limited"),
+    ("public", "company"), ("cong", "ty"), ("sdn", "bhd"),
+]
+LEGAL_TOKENS = {
+    "co", "ltd", "limited", "company", "corp", "corporation", "inc", "incorporated", "llc", "plc",
+    "jsc", "pt", "tbk", "sa", "as", "doo", "gmbh", "srl", "spa", "bv", "ag", "ltda", "pte", "pvt", "tnhh",
+}
+
+# Minimum trigram similarity for a fuzzy match
+MIN_SCORE = 0.8
+# Rarest query trigrams used to collect candidates, and how many candidates are scored
+MAX_PROBE_GRAMS = 12
+MAX_CANDIDATES = 50
+
+def normalize_name(name):
+    """Company name reduced to lowercase ASCII words, without legal forms; 'Viet Nam' becomes 'vietnam'"""
+    text = unicodedata.normalize("NFKD", str(name or "").lower().replace("đ", "d"))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    # "Co.,Ltd", "A.S." and "d.o.o." lose their dots before splitting on punctuation
+    tokens = re.sub(r"[^a-z0-9]+", " ", text.replace(".", "")).split()
+
+    merged = []
+    for token in tokens:
+        if token == "nam" and merged and merged[-1] == "viet":
+            merged[-1] = "vietnam"
+        else:
+            merged.append(token)
+
+    stripped = _strip_legal(merged)
+    # A name made only of legal words keeps them rather than becoming empty
+    return " ".join(stripped or merged)
+
+def _strip_legal(tokens):
+    result = []
+    i = 0
+    while i < len(tokens):
+        phrase = next((p for p in LEGAL_PHRASES if tuple(tokens[i:i + len(p)]) == p), None)
+        if phrase is not None:
+            i += len(phrase)
+        elif tokens[i] in LEGAL_TOKENS:
+            i += 1
+        else:
+            result.append(tokens[i])
+            i += 1
+    return result
+
+def trigrams(text):
+    padded = f" {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+class NameIndex:
+    """Character-trigram index over normalized names, returning positions with a similarity score"""
+
+    def __init__(self, names):
+        self.exact = {}
+        self.grams = []
+        postings = defaultdict(list)
+        for idx, name in enumerate(names):
+            key = normalize_name(name)
+            grams = trigrams(key) if key else frozenset()
+            self.grams.append(grams)
+            if key:
+                self.exact.setdefault(key, idx)
+            for gram in grams:
+                postings[gram].append(idx)
+        self.postings = {gram: tuple(ids) for gram, ids in postings.items()}
+
+    def search(self, name, min_score=MIN_SCORE):
+        """(position, score) of the most similar name, or None below min_score"""
+        key = normalize_name(name)
+        if not key:
+            return None
+        if key in self.exact:
+            return self.exact[key], 1.0
+
+        grams = trigrams(key)
+        # The rarest grams are the most selective; common ones such as "ing" would touch most names
+        probe = sorted((g for g in grams if g in self.postings), key=lambda g: len(self.postings[g]))
+        counts = defaultdict(int)
+        for gram in probe[:MAX_PROBE_GRAMS]:
+            for idx in self.postings[gram]:
+                counts[idx] += 1
+
+        best, best_score = None, 0.0
+        for idx in sorted(counts, key=counts.get, reverse=True)[:MAX_CANDIDATES]:
+            other = self.grams[idx]
+            score = 2 * len(grams & other) / (len(grams) + len(other))
+            if score > best_score:
+                best, best_score = idx, score
+
+        if best is None or best_score < min_score:
+            return None
+        return best, best_score
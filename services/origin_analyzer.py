@@ -1,26 +1,56 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import pandas as pd
 from models import AnalysisSession, MaterialAnalysis
 from app import db
-from services.hs_code_service import HSCodeService
-from services.fta_rules_engine import FTARulesEngine
-from services.gemini_explanation_service import GeminiExplanationService
+from sqlalchemy import insert
+from sqlalchemy.orm.attributes import flag_modified
+from services.reference_data import registry
 from services.manufacturers import lookup as manu_lookup
 import os
 
 logger = logging.getLogger(__name__)
 
+EU_COUNTRIES = frozenset([
+    'AT', 'BE', 'BG', 'CY', 'CZ', 'DE', 'DK', 'EE', 'ES', 'FI',
+    'FR', 'GR', 'HR', 'HU', 'IE', 'IT', 'LT', 'LU', 'LV', 'MT',
+    'NL', 'PL', 'PT', 'RO', 'SE', 'SI', 'SK'
+])
+VN_COUNTRIES = frozenset(['VN', 'VIETNAM'])
+EMPTY_COUNTRIES = frozenset(['NAN', 'NONE', ''])
+
+# Both Gemini calls of an analysis run in parallel on this shared, bounded pool
+EXPLANATION_TIMEOUT = float(os.environ.get("EXPLANATION_TIMEOUT", "30"))
+_explanation_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("EXPLANATION_MAX_CONCURRENCY", "8")),
+    thread_name_prefix='gemini'
+)
+
+MATERIAL_COLUMNS = [
+    'session_id', 'material_name', 'country_of_origin', 'hs_code',
+    'cost_per_pair', 'is_problematic', 'analysis_notes'
+]
+
 class OriginAnalyzer:
-    def __init__(self):
-        self.hs_service = HSCodeService()
-        self.fta_engine = FTARulesEngine()
-        self.gemini_service = GeminiExplanationService()
+    def __init__(self, single_transaction=False, lazy_explanations=False):
+        self.single_transaction = single_transaction
+        self.lazy_explanations = lazy_explanations
+        self.hs_service = registry.hs_service()
+        self.fta_engine = registry.fta_engine()
+        self.gemini_service = registry.gemini_service()
         self.analysis_steps = []
         self.missing_fields = []
+        self.materials = pd.DataFrame(columns=MATERIAL_COLUMNS)
     
     def analyze_origin(self, data, session_id):
         """Main origin analysis following the 7-step workflow"""
         session = AnalysisSession.query.get(session_id)
         
+        # Steps run column-wise over a DataFrame; row dicts are still accepted
+        if not isinstance(data, pd.DataFrame):
+            data = pd.DataFrame.from_records(data)
+        
         try:
             # Step 1: Check manufacturer location
             manufacturer_result = self._step1_check_manufacturer(data, session)
@@ -64,10 +94,29 @@ class OriginAnalyzer:
             
         except Exception as e:
             logger.error(f"Error in origin analysis: {str(e)}")
+            if self.single_transaction:
+                # Nothing has been committed yet, so drop the half-applied step state
+                db.session.rollback()
             self._finalize_analysis(session, 'error', f"Analysis error: {str(e)}")
         
         return session
     
+    def _commit(self):
+        """Commit a step, or defer it to _finalize_analysis in single-transaction mode"""
+        if not self.single_transaction:
+            db.session.commit()
+    
+    @staticmethod
+    def _first_value(data, column):
+        """First non-empty value of a column as a stripped string, or None"""
+        if column not in data.columns:
+            return None
+        
+        for value in data[column]:
+            if value and str(value).strip():
+                return str(value).strip()
+        return None
+    
     def _step1_check_manufacturer(self, data, session):
         """
         Step 1: Check if manufacturer is Vietnamese using manufacturers.csv.
@@ -76,24 +125,13 @@ class OriginAnalyzer:
         logger.info("Step 1: Checking manufacturer location")
 
         # Extract manufacturer fields from input data
-        manufacturer = None
-        manufacturer_id = None
-        manufacturer_country = None
-
-        for row in data:
-            if not manufacturer and row.get("manufacturer"):
-                manufacturer = str(row["manufacturer"]).strip()
-            if not manufacturer_id and row.get("manufacturer_id"):
-                manufacturer_id = str(row["manufacturer_id"]).strip()
-            if not manufacturer_country and row.get("manufacturer_country"):
-                manufacturer_country = str(row["manufacturer_country"]).strip()
+        manufacturer = self._first_value(data, "manufacturer")
+        manufacturer_id = self._first_value(data, "manufacturer_id")
+        manufacturer_country = self._first_value(data, "manufacturer_country")
 
         # Fallback to 'country_of_origin' if manufacturer_country not provided
         if not manufacturer_country:
-            for row in data:
-                if row.get("country_of_origin"):
-                    manufacturer_country = str(row["country_of_origin"]).strip()
-                    break
+            manufacturer_country = self._first_value(data, "country_of_origin")
 
         if not manufacturer and not manufacturer_id:
             self.missing_fields.append("manufacturer")
@@ -115,7 +153,7 @@ class OriginAnalyzer:
                 "proceed": is_vn
             })
             session.analysis_steps = self.analysis_steps
-            db.session.commit()
+            self._commit()
             if not is_vn:
                 return {"proceed": False, "reason": "Manufacturer found in reference list but not located in Vietnam."}
             return {"proceed": True, "reason": "Manufacturer found in Vietnam reference list."}
@@ -132,7 +170,7 @@ class OriginAnalyzer:
                 "proceed": is_vn
             })
             session.analysis_steps = self.analysis_steps
-            db.session.commit()
+            self._commit()
             if not is_vn:
                 return {"proceed": False, "reason": f"Provided manufacturer country is '{manufacturer_country}', not Vietnam."}
             return {"proceed": True, "reason": f"Manufacturer country provided as '{manufacturer_country}' (Vietnam)."}
@@ -146,7 +184,7 @@ class OriginAnalyzer:
             "proceed": False
         })
         session.analysis_steps = self.analysis_steps
-        db.session.commit()
+        self._commit()
         return {"proceed": False, "reason": "Manufacturer could not be verified (missing data)."}
 
     def _step2_find_hs_code(self, data, session):
@@ -156,17 +194,13 @@ class OriginAnalyzer:
         # Look for final product HS code in the data
         final_hs_code = None
         
-        # Check if there's a specific final product row or look for the most common HS code
-        hs_codes = []
-        for row in data:
-            if 'hs_code' in row and row['hs_code']:
-                hs_code = str(row['hs_code']).strip()
-                if hs_code and hs_code.lower() not in ['nan', 'none', '']:
-                    hs_codes.append(hs_code)
-        
-        if hs_codes:
-            # Use the first HS code as final product (this logic could be improved)
-            final_hs_code = hs_codes[0]
+        # Use the first HS code as final product (this logic could be improved)
+        if 'hs_code' in data.columns:
+            final_hs_code = next(
+                (str(v).strip() for v in data['hs_code']
+                 if v and str(v).strip().lower() not in ['nan', 'none', '']),
+                None
+            )
         
         if not final_hs_code:
             self.missing_fields.append('final_product_hs_code')
@@ -187,7 +221,7 @@ class OriginAnalyzer:
         
         self.analysis_steps.append(step_result)
         session.analysis_steps = self.analysis_steps
-        db.session.commit()
+        self._commit()
         
         return {'proceed': True, 'hs_code': final_hs_code}
     
@@ -209,7 +243,7 @@ class OriginAnalyzer:
         
         self.analysis_steps.append(step_result)
         session.analysis_steps = self.analysis_steps
-        db.session.commit()
+        self._commit()
         
         return {'proceed': True, 'rules': fta_rules}
     
@@ -217,78 +251,78 @@ class OriginAnalyzer:
         """Step 4: Identify non-VN and non-EU materials"""
         logger.info("Step 4: Identifying non-VN and non-EU materials")
         
-        non_vn_eu_materials = []
+        if 'country_of_origin' in data.columns:
+            country = data['country_of_origin'].astype(str).str.strip().str.upper()
+            is_non_vn_eu = country.notna() & ~country.isin(EMPTY_COUNTRIES | VN_COUNTRIES | EU_COUNTRIES)
+        else:
+            country = pd.Series('', index=data.index, dtype=object)
+            is_non_vn_eu = pd.Series(False, index=data.index)
         
-        for row in data:
-            if 'country_of_origin' not in row:
-                continue
-                
-            country = str(row.get('country_of_origin', '')).strip().upper()
-            
-            if not country or country in ['NAN', 'NONE', '']:
-                continue
-            
-            # Check if country is not VN or EU
-            eu_countries = [
-                'AT', 'BE', 'BG', 'CY', 'CZ', 'DE', 'DK', 'EE', 'ES', 'FI', 
-                'FR', 'GR', 'HR', 'HU', 'IE', 'IT', 'LT', 'LU', 'LV', 'MT', 
-                'NL', 'PL', 'PT', 'RO', 'SE', 'SI', 'SK'
-            ]
-            
-            if country not in ['VN', 'VIETNAM'] and country not in eu_countries:
-                # Create material analysis record
-                material = MaterialAnalysis(
-                    session_id=session.id,
-                    material_name=str(row.get('material_name', 'Unknown')),
-                    country_of_origin=country,
-                    hs_code=str(row.get('hs_code', '')),
-                    cost_per_pair=float(row.get('cost_per_pair', 0)) if row.get('cost_per_pair') else None,
-                    is_problematic=True,
-                    analysis_notes='Non-VN and non-EU material requiring further analysis'
-                )
-                db.session.add(material)
-                non_vn_eu_materials.append(material)
+        rows = data[is_non_vn_eu]
         
-        db.session.commit()
+        # Material rows are kept as a frame and bulk inserted by _persist_materials
+        materials = pd.DataFrame({
+            'session_id': session.id,
+            'material_name': rows['material_name'].astype(str) if 'material_name' in rows else 'Unknown',
+            'country_of_origin': country[is_non_vn_eu],
+            'hs_code': rows['hs_code'].astype(str) if 'hs_code' in rows else '',
+            'cost_per_pair': self._to_costs(rows['cost_per_pair']) if 'cost_per_pair' in rows else np.nan,
+            'is_problematic': True,
+            'analysis_notes': 'Non-VN and non-EU material requiring further analysis'
+        }, index=rows.index, columns=MATERIAL_COLUMNS).reset_index(drop=True)
+        
+        self.materials = materials
         
         step_result = {
             'step': 4,
             'description': 'Non-VN and non-EU materials identification',
-            'materials_found': len(non_vn_eu_materials),
+            'materials_found': len(materials),
             'materials': [
                 {
-                    'name': m.material_name,
-                    'country': m.country_of_origin,
-                    'hs_code': m.hs_code
-                } for m in non_vn_eu_materials
+                    'name': name,
+                    'country': country_code,
+                    'hs_code': hs_code
+                } for name, country_code, hs_code in zip(
+                    materials['material_name'], materials['country_of_origin'], materials['hs_code']
+                )
             ]
         }
         
         self.analysis_steps.append(step_result)
         session.analysis_steps = self.analysis_steps
-        db.session.commit()
+        self._commit()
         
-        return {'materials': non_vn_eu_materials}
+        return {'materials': materials}
+    
+    @staticmethod
+    def _to_costs(costs):
+        """Convert a cost column to float64, treating empty, zero and NaN cells as missing"""
+        costs = pd.to_numeric(costs, errors='coerce').astype('float64')
+        return costs.where(costs != 0)
     
     def _step5_check_material_hs_codes(self, session):
         """Step 5: Check HS codes of non-VN and non-EU materials"""
         logger.info("Step 5: Checking HS codes of problematic materials")
         
-        materials = MaterialAnalysis.query.filter_by(session_id=session.id, is_problematic=True).all()
+        materials = self.materials[self.materials['is_problematic']]
+        hs_codes = materials['hs_code']
         
-        for material in materials:
-            if material.hs_code:
-                # Validate and normalize HS code
-                if self.hs_service.is_valid_hs_code(material.hs_code):
-                    material.analysis_notes += f" | HS code {material.hs_code} validated"
-                else:
-                    material.analysis_notes += f" | Invalid HS code: {material.hs_code}"
-                    self.missing_fields.append(f'valid_hs_code_for_{material.material_name}')
-            else:
-                material.analysis_notes += " | Missing HS code"
-                self.missing_fields.append(f'hs_code_for_{material.material_name}')
+        has_hs = hs_codes != ''
+        is_valid = has_hs & hs_codes.map(self.hs_service.is_valid_hs_code).astype(bool)
         
-        db.session.commit()
+        notes = np.select(
+            [is_valid, has_hs],
+            [" | HS code " + hs_codes + " validated", " | Invalid HS code: " + hs_codes],
+            default=" | Missing HS code"
+        )
+        self.materials.loc[materials.index, 'analysis_notes'] += notes
+        
+        # Missing fields keep the row order of the sheet
+        for name, hs_present in zip(materials['material_name'][~is_valid], has_hs[~is_valid]):
+            if hs_present:
+                self.missing_fields.append(f'valid_hs_code_for_{name}')
+            else:
+                self.missing_fields.append(f'hs_code_for_{name}')
         
         step_result = {
             'step': 5,
@@ -298,23 +332,21 @@ class OriginAnalyzer:
         
         self.analysis_steps.append(step_result)
         session.analysis_steps = self.analysis_steps
-        db.session.commit()
+        self._commit()
         
         return {'checked': len(materials)}
     
+    def _heading_6406_mask(self):
+        """Boolean mask of problematic materials classified under heading 6406"""
+        return self.materials['is_problematic'] & self.materials['hs_code'].str.startswith('6406')
+    
     def _step6_check_heading_6406(self, session):
         """Step 6: Check if any materials fall under heading 6406"""
         logger.info("Step 6: Checking for heading 6406 materials")
         
-        materials = MaterialAnalysis.query.filter_by(session_id=session.id, is_problematic=True).all()
-        heading_6406_materials = []
-        
-        for material in materials:
-            if material.hs_code and material.hs_code.startswith('6406'):
-                heading_6406_materials.append(material)
-                material.analysis_notes += " | Falls under heading 6406"
-        
-        db.session.commit()
+        in_6406 = self._heading_6406_mask()
+        self.materials.loc[in_6406, 'analysis_notes'] += " | Falls under heading 6406"
+        heading_6406_materials = self.materials[in_6406]
         
         step_result = {
             'step': 6,
@@ -324,7 +356,7 @@ class OriginAnalyzer:
         
         self.analysis_steps.append(step_result)
         session.analysis_steps = self.analysis_steps
-        db.session.commit()
+        self._commit()
         
         return {
             'has_6406': len(heading_6406_materials) > 0,
@@ -335,26 +367,14 @@ class OriginAnalyzer:
         """Step 7: Compare costs for materials under heading 6406"""
         logger.info("Step 7: Performing cost analysis")
         
-        materials_6406 = MaterialAnalysis.query.filter(
-            MaterialAnalysis.session_id == session.id,
-            MaterialAnalysis.is_problematic == True,
-            MaterialAnalysis.hs_code.like('6406%')
-        ).all()
-        
         # Get total FOB cost (this should come from the original data)
         # For now, we'll calculate based on available data
-        all_materials = MaterialAnalysis.query.filter_by(session_id=session.id).all()
-        total_cost = 0
-        materials_6406_cost = 0
-        missing_cost_data = []
-        
-        for material in all_materials:
-            if material.cost_per_pair is not None:
-                if material in materials_6406:
-                    materials_6406_cost += material.cost_per_pair
-                total_cost += material.cost_per_pair
-            else:
-                missing_cost_data.append(material.material_name)
+        costs = self.materials['cost_per_pair']
+        has_cost = costs.notna()
+        
+        total_cost = float(costs[has_cost].sum())
+        materials_6406_cost = float(costs[has_cost & self._heading_6406_mask()].sum())
+        missing_cost_data = self.materials.loc[~has_cost, 'material_name'].tolist()
         
         if missing_cost_data:
             for material_name in missing_cost_data:
@@ -374,31 +394,61 @@ class OriginAnalyzer:
         
         self.analysis_steps.append(step_result)
         session.analysis_steps = self.analysis_steps
-        db.session.commit()
+        self._commit()
         
         return step_result
     
+    def _material_records(self):
+        """Material rows as plain dicts, with NaN costs converted to None"""
+        materials = self.materials[MATERIAL_COLUMNS].astype(object)
+        return materials.where(materials.notna(), None).to_dict('records')
+    
+    def _persist_materials(self):
+        """Insert all material rows built in step 4 with a single executemany"""
+        if not self.materials.empty:
+            db.session.execute(insert(MaterialAnalysis), self._material_records())
+    
     def _finalize_analysis(self, session, result, reason):
         """Finalize the analysis with result and reason"""
         session.final_result = result
         session.result_reason = reason
+        session.analysis_steps = self.analysis_steps
+        # The step list is mutated in place between flushes, so mark it dirty explicitly
+        flag_modified(session, 'analysis_steps')
         session.missing_fields = self.missing_fields
         session.completed = True
+        self._persist_materials()
+        
+        # In lazy mode the determination is committed without waiting on Gemini;
+        # explanations are generated when the results are first viewed
+        if not self.lazy_explanations:
+            self._apply_explanations(session)
         
-        # Generate Gemini explanations
+        db.session.commit()
+        logger.info(f"Analysis completed for session {session.id}: {result} - {reason}")
+    
+    def generate_explanations(self, session):
+        """Generate and store the Gemini explanations for a completed session"""
+        self._apply_explanations(session)
+        db.session.commit()
+        return session
+    
+    def _apply_explanations(self, session):
+        """Generate Gemini explanations from the persisted session and set them on it"""
         try:
             # Prepare session data for Gemini
             session_data = {
                 'manufacturer': session.manufacturer,
-                'final_result': result,
-                'result_reason': reason,
-                'missing_fields': self.missing_fields,
-                'analysis_steps': self.analysis_steps,
+                'final_result': session.final_result,
+                'result_reason': session.result_reason,
+                'missing_fields': session.missing_fields or [],
+                'analysis_steps': session.analysis_steps or [],
                 'final_hs_code': session.final_hs_code
             }
+            missing_fields = session_data['missing_fields']
             
             # Get materials data
-            materials = MaterialAnalysis.query.filter_by(session_id=session.id).all()
+            materials = MaterialAnalysis.query.filter_by(session_id=session.id).order_by(MaterialAnalysis.id).all()
             materials_data = [
                 {
                     'material_name': m.material_name,
@@ -410,23 +460,39 @@ class OriginAnalyzer:
                 for m in materials
             ]
             
+            # Issue the explanation and missing data analysis concurrently under one deadline
+            explanation_future = _explanation_pool.submit(
+                self.gemini_service.generate_origin_explanation, session_data, materials_data
+            )
+            missing_future = None
+            if missing_fields:
+                missing_future = _explanation_pool.submit(
+                    self.gemini_service.generate_missing_data_analysis, missing_fields, materials_data
+                )
+            
+            done, _ = wait([f for f in (explanation_future, missing_future) if f], timeout=EXPLANATION_TIMEOUT)
+            
             # Generate comprehensive explanation
-            explanation = self.gemini_service.generate_origin_explanation(session_data, materials_data)
+            if explanation_future in done:
+                explanation = explanation_future.result()
+            else:
+                logger.warning(f"Gemini explanation timed out for session {session.id}, using fallback")
+                explanation = self.gemini_service._generate_fallback_explanation(session_data, materials_data)
             if explanation:
                 session.gemini_explanation = explanation
                 logger.info(f"Generated Gemini explanation for session {session.id}")
             
             # Generate missing data analysis if there are missing fields
-            if self.missing_fields:
-                missing_analysis = self.gemini_service.generate_missing_data_analysis(
-                    self.missing_fields, materials_data
-                )
+            if missing_future is not None:
+                if missing_future in done:
+                    missing_analysis = missing_future.result()
+                else:
+                    # There is no offline version of this analysis; leave the panel empty
+                    logger.warning(f"Missing data analysis timed out for session {session.id}")
+                    missing_analysis = None
                 if missing_analysis:
                     session.missing_data_analysis = missing_analysis
                     logger.info(f"Generated missing data analysis for session {session.id}")
                     
         except Exception as e:
             logger.error(f"Error generating Gemini explanations: {str(e)}")
-        
-        db.session.commit()
-        logger.info(f"Analysis completed for session {session.id}: {result} - {reason}")
@@ -0,0 +1,64 @@
+import os
+import threading
+import logging
+from services.hs_code_service import HSCodeService
+from services.fta_rules_engine import FTARulesEngine
+from services.gemini_explanation_service import GeminiExplanationService
+from services.manufacturers import table_version
+
+logger = logging.getLogger(__name__)
+
+HS_CODES_FILES = [os.path.join('config', 'hs_codes.json')]
+FTA_RULES_FILES = [os.path.join('config', 'agreement.json'), os.path.join('config', 'fta_rules.json')]
+MANUFACTURERS_FILES = [os.path.join('config', 'manufacturers.csv')]
+
+class ReferenceDataRegistry:
+    """Process-wide, read-only reference-data services, rebuilt when their config files change"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _file_stamp(self, paths):
+        """Modification times of the source files (None for files that do not exist)"""
+        stamp = []
+        for path in paths:
+            try:
+                stamp.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _get(self, name, paths, factory):
+        """Return the cached instance for name, rebuilding it if its files changed"""
+        stamp = self._file_stamp(paths)
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != stamp:
+                logger.info(f"Loading reference data: {name}")
+                # Build outside the dict so readers never see a half-initialised service
+                entry = (stamp, factory())
+                self._entries[name] = entry
+            return entry[1]
+
+    def versions(self):
+        """Version string of all reference data, used to key cached analysis results"""
+        stamp = self._file_stamp(HS_CODES_FILES + FTA_RULES_FILES + MANUFACTURERS_FILES)
+        # Manufacturers can also change through imports into the database
+        return ':'.join(str(part) for part in stamp + (table_version(),))
+
+    def hs_service(self):
+        return self._get('hs_codes', HS_CODES_FILES, HSCodeService)
+
+    def fta_engine(self):
+        return self._get('fta_rules', FTA_RULES_FILES, FTARulesEngine)
+
+    def gemini_service(self):
+        # The client has no file inputs, so it is built once per process
+        return self._get('gemini', [], GeminiExplanationService)
+
+registry = ReferenceDataRegistry()
@@ -0,0 +1,90 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from models import MaterialAnalysis
+from app import db
+from services.file_processor import FileProcessor, REPORT_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Bump when the report layout changes so previously built files are not served again
+REPORT_FORMAT_VERSION = 2
+
+SESSION_FIELDS = [
+    'filename', 'upload_timestamp', 'manufacturer', 'final_hs_code', 'analysis_steps',
+    'final_result', 'result_reason', 'missing_fields', 'completed'
+]
+MATERIAL_FIELDS = [
+    MaterialAnalysis.id, MaterialAnalysis.material_name, MaterialAnalysis.country_of_origin,
+    MaterialAnalysis.hs_code, MaterialAnalysis.cost_per_pair, MaterialAnalysis.is_problematic,
+    MaterialAnalysis.analysis_notes
+]
+
+class ReportStore:
+    """Built XLSX reports on disk, one file per session version, rebuilt only when the session changes"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def version(self, session):
+        """Content hash of everything the report shows: the session, its sheets and its materials"""
+        digest = hashlib.sha256(f"report-v{REPORT_FORMAT_VERSION}".encode())
+        fields = {field: getattr(session, field) for field in SESSION_FIELDS}
+        fields['sheets'] = [
+            [sheet.sheet_name, sheet.session.final_result, sheet.session.result_reason]
+            for sheet in session.sheets
+        ]
+        digest.update(json.dumps(fields, sort_keys=True, default=str).encode())
+
+        # Plain column tuples, so hashing thousands of rows never builds ORM objects
+        rows = (db.session.query(*MATERIAL_FIELDS).filter(MaterialAnalysis.session_id == session.id)
+                .order_by(MaterialAnalysis.id).yield_per(REPORT_CHUNK_SIZE))
+        for row in rows:
+            digest.update(repr(tuple(row)).encode())
+
+        return digest.hexdigest()
+
+    def open(self, session):
+        """The session's current report, opened for reading, and its version; built if needed.
+        
+        The file is opened before it is returned: another worker may remove it as stale once the
+        session changes, and an open file stays readable after its name is removed.
+        """
+        version = self.version(session)
+        path = os.path.join(self.folder, f"fta_results_{session.id}_{version[:16]}.xlsx")
+        try:
+            return open(path, 'rb'), version
+        except FileNotFoundError:
+            pass
+        
+        with self._lock:
+            if not os.path.exists(path):
+                logger.info(f"Building report for session {session.id} (version {version[:16]})")
+                # Other worker processes may build the same version at once; each writes its own file
+                fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.xlsx.tmp')
+                os.close(fd)
+                try:
+                    FileProcessor().generate_results_report(session.id, results_path=tmp_path)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    os.remove(tmp_path)
+                    raise
+                self._remove_stale(session.id, path)
+            report = open(path, 'rb')
+        
+        return report, version
+    
+    def _remove_stale(self, session_id, current_path):
+        """Delete reports built for earlier versions of a session"""
+        for path in glob.glob(os.path.join(self.folder, f"fta_results_{session_id}_*.xlsx")):
+            if path != current_path:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Could not remove stale report {path}: {str(e)}")
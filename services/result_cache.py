@@ -0,0 +1,105 @@
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import pandas as pd
+from sqlalchemy import insert
+from models import AnalysisSession, MaterialAnalysis
+from app import db
+from services.reference_data import registry
+
+logger = logging.getLogger(__name__)
+
+SESSION_FIELDS = [
+    'manufacturer', 'final_hs_code', 'analysis_steps', 'final_result', 'result_reason',
+    'missing_fields', 'gemini_explanation', 'missing_data_analysis'
+]
+MATERIAL_FIELDS = [
+    'material_name', 'country_of_origin', 'hs_code', 'cost_per_pair',
+    'is_problematic', 'analysis_notes'
+]
+
+class ResultCache:
+    """Size-bounded LRU of finished analyses, keyed on BOM content and reference-data versions"""
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # Sessions created from or cloned out of each snapshot, so explanations generated
+        # later for any of them can be written back
+        self._session_keys = {}
+        self._lock = threading.Lock()
+
+    def make_key(self, data):
+        """Content hash of the normalized rows plus the versions of the reference files"""
+        digest = hashlib.sha256()
+        digest.update(registry.versions().encode())
+        digest.update('\x1f'.join(map(str, data.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(data.astype(str), index=False).values.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached snapshot for key and mark it most recently used"""
+        if self.max_entries <= 0:
+            return None
+
+        with self._lock:
+            snapshot = self._entries.get(key)
+            if snapshot is not None:
+                self._entries.move_to_end(key)
+            return snapshot
+
+    def put(self, key, session_id):
+        """Snapshot a completed session's result and materials under key"""
+        if self.max_entries <= 0:
+            return
+
+        session = AnalysisSession.query.get(session_id)
+        materials = MaterialAnalysis.query.filter_by(session_id=session_id).order_by(MaterialAnalysis.id).all()
+        snapshot = {
+            'session': {field: copy.deepcopy(getattr(session, field)) for field in SESSION_FIELDS},
+            'materials': [{field: getattr(m, field) for field in MATERIAL_FIELDS} for m in materials],
+            'session_ids': {session_id},
+        }
+
+        with self._lock:
+            self._entries[key] = snapshot
+            self._entries.move_to_end(key)
+            self._session_keys[session_id] = key
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                for evicted_id in evicted['session_ids']:
+                    self._session_keys.pop(evicted_id, None)
+
+    def store_explanations(self, session):
+        """Copy explanations generated after the analysis into the snapshot the session belongs to"""
+        with self._lock:
+            snapshot = self._entries.get(self._session_keys.get(session.id))
+            if snapshot is None:
+                return
+            for field in ('gemini_explanation', 'missing_data_analysis'):
+                value = getattr(session, field)
+                if value is not None and snapshot['session'][field] is None:
+                    snapshot['session'][field] = copy.deepcopy(value)
+
+    def clone_into(self, key, snapshot, session_id):
+        """Populate a new session from a cached snapshot without re-running the analysis"""
+        session = AnalysisSession.query.get(session_id)
+        for field, value in snapshot['session'].items():
+            setattr(session, field, copy.deepcopy(value))
+        session.completed = True
+
+        if snapshot['materials']:
+            db.session.execute(
+                insert(MaterialAnalysis),
+                [dict(material, session_id=session_id) for material in snapshot['materials']]
+            )
+
+        db.session.commit()
+        with self._lock:
+            if self._entries.get(key) is snapshot:
+                snapshot['session_ids'].add(session_id)
+                self._session_keys[session_id] = key
+        logger.info(f"Analysis for session {session_id} served from result cache")
+        return session
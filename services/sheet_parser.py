@@ -0,0 +1,471 @@
+import numpy as np
+import pandas as pd
+import os
+import io
+import hashlib
+import logging
+import importlib.util
+import csv
+from itertools import islice
+from openpyxl import load_workbook
+from services.column_mapping import column_resolver, canonical_header
+
+# Nothing here may import the Flask app or the models: sheet-parsing worker processes
+# import this module, and must not create tables or start queues of their own
+
+logger = logging.getLogger(__name__)
+
+# Rows per batch when streaming a sheet
+BATCH_SIZE = 5000
+
+# Rows searched for the table header and the metadata block (manufacturer, style...) above it
+SCAN_ROWS = 30
+
+# Preamble labels of sheet-level values, in canonical header form
+METADATA_LABELS = {
+    'manufacturer': ['manufacturer', 'manufacturer_name', 'supplier', 'supplier_name',
+                     'vendor', 'vendor_name', 'factory', 'factory_name', 'mfg'],
+    'manufacturer_id': ['manufacturer_id', 'factory_id', 'factory_code', 'factory_no',
+                        'supplier_id', 'supplier_code', 'vendor_id', 'vendor_code'],
+    'style': ['style', 'style_no', 'style_number', 'style_name', 'article', 'article_no'],
+    'season': ['season'],
+}
+METADATA_FIELDS = {label: field for field, labels in METADATA_LABELS.items() for label in labels}
+
+# Unmapped columns the analyzer still reads, kept alongside the mapped ones when projecting
+PASSTHROUGH_COLUMNS = ['manufacturer_id', 'manufacturer_country']
+
+# Low-cardinality code columns stored as categoricals once a sheet is parsed
+CATEGORICAL_COLUMNS = ['country_of_origin', 'hs_code']
+
+# Parsing backends in order of preference, with the optional module each one needs
+CSV_ENGINES = {'pyarrow': 'pyarrow', 'c': None}
+XLSX_ENGINES = {'calamine': 'python_calamine', 'openpyxl': 'openpyxl'}
+
+# "auto" picks the fastest installed backend; the last entry of each table is always the fallback
+CSV_ENGINE = os.environ.get("CSV_ENGINE", "auto")
+XLSX_ENGINE = os.environ.get("XLSX_ENGINE", "auto")
+
+def _engine_available(engines, name):
+    module = engines.get(name, False)
+    if module is False:
+        return False
+    return module is None or importlib.util.find_spec(module) is not None
+
+def resolve_engine(engines, requested):
+    """The backend to use for a requested engine name, falling back when it is not installed"""
+    if requested == 'auto':
+        return next(name for name in engines if _engine_available(engines, name))
+    if _engine_available(engines, requested):
+        return requested
+    
+    fallback = list(engines)[-1]
+    logger.warning(f"Parsing engine '{requested}' is not available, using '{fallback}'")
+    return fallback
+
+class UploadBuffer:
+    """An uploaded file held in memory, so it can be parsed without touching the disk"""
+    
+    def __init__(self, filename, content):
+        self.filename = filename
+        self.content = content
+        self.ext = os.path.splitext(filename)[1].lower()
+    
+    @classmethod
+    def from_storage(cls, storage):
+        """Read an incoming werkzeug FileStorage stream into a buffer"""
+        return cls(storage.filename, storage.stream.read())
+    
+    def open(self):
+        """A fresh file-like object over the content; readers can each consume their own"""
+        return io.BytesIO(self.content)
+    
+    @property
+    def digest(self):
+        return hashlib.sha256(self.content).hexdigest()
+    
+    def persist(self, folder):
+        """Write the raw file under a content-addressed name and return its path"""
+        path = os.path.join(folder, f"{self.digest}{self.ext}")
+        # Identical uploads share one file, and a file once written never changes
+        if not os.path.exists(path):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(self.content)
+            os.replace(tmp_path, path)
+        return path
+    
+    def __str__(self):
+        return self.filename
+
+class SheetParser:
+    """Reads costing sheets (CSV, XLS, XLSX) into cleaned, column-mapped DataFrames"""
+    
+    def __init__(self, csv_engine=None, xlsx_engine=None):
+        self.required_columns = [
+            'manufacturer', 'country_of_origin', 'hs_code', 
+            'cost_per_pair', 'fob_with_tooling', 'material_name'
+        ]
+        self.csv_engine = resolve_engine(CSV_ENGINES, csv_engine or CSV_ENGINE)
+        self.xlsx_engine = resolve_engine(XLSX_ENGINES, xlsx_engine or XLSX_ENGINE)
+    
+    def process_file(self, source):
+        """Process uploaded Excel or CSV file and extract costing data"""
+        return self.process_frame(source).to_dict('records')
+    
+    def process_frame(self, source, sheet_name=None):
+        """Process uploaded Excel or CSV file (a path or an UploadBuffer) into a cleaned, column-mapped DataFrame"""
+        try:
+            batches = list(self.iter_batches(source, sheet_name=sheet_name))
+            if not batches:
+                return pd.DataFrame()
+            
+            return self._compact_dtypes(pd.concat(batches, ignore_index=True))
+            
+        except Exception as e:
+            logger.error(f"Error processing file {source}: {str(e)}")
+            raise
+    
+    def iter_batches(self, source, batch_size=BATCH_SIZE, sheet_name=None):
+        """Yield cleaned, column-mapped DataFrames of at most batch_size rows"""
+        # The header is shared by every batch, so the layout and mapping are resolved once
+        header_row, header, metadata = self._scan_layout(self._scan_rows(source, sheet_name))
+        if header is None:
+            return
+        
+        logger.info(f"Table header at row {header_row + 1}, sheet metadata: {metadata}")
+        mapped_columns = self._map_columns(header)
+        
+        # Only the columns the analysis uses are read from the rest of the sheet
+        usecols = self._projection(header, mapped_columns)
+        
+        for df in self._read_batches(source, batch_size, sheet_name, usecols, header_row):
+            df.columns = self._normalize_columns(df.columns)
+            
+            # Rename columns to standardized names
+            df_renamed = df.rename(columns={v: k for k, v in mapped_columns.items()})
+            
+            # Values from the preamble only fill columns the table itself does not have
+            for field, value in metadata.items():
+                if field not in df_renamed.columns:
+                    df_renamed[field] = value
+            
+            # Clean and validate data
+            yield self._clean_data(df_renamed)
+    
+    def _source_ext(self, source):
+        """Lowercase extension of a file path or UploadBuffer"""
+        if isinstance(source, UploadBuffer):
+            return source.ext
+        return os.path.splitext(source)[1].lower()
+    
+    def _open_source(self, source):
+        """Something the pandas and openpyxl readers accept: the path itself or an in-memory stream"""
+        if isinstance(source, UploadBuffer):
+            return source.open()
+        return source
+    
+    def _scan_rows(self, source, sheet_name=None):
+        """Raw cell values of the first SCAN_ROWS rows of a sheet, with empty cells as None"""
+        file_ext = self._source_ext(source)
+        
+        if file_ext == '.xlsx':
+            wb = load_workbook(self._open_source(source), read_only=True, data_only=True)
+            try:
+                ws = wb[sheet_name] if sheet_name is not None else wb.worksheets[0]
+                return list(islice(ws.iter_rows(values_only=True), SCAN_ROWS))
+            finally:
+                wb.close()
+        elif file_ext == '.xls':
+            df = pd.read_excel(self._open_source(source), header=None, nrows=SCAN_ROWS, dtype=object,
+                               sheet_name=sheet_name if sheet_name is not None else 0)
+            return self._frame_rows(df)
+        elif file_ext == '.csv':
+            stream = source.open() if isinstance(source, UploadBuffer) else open(source, 'rb')
+            with io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='') as text:
+                return [[value if value.strip() else None for value in row]
+                        for row in islice(csv.reader(text), SCAN_ROWS)]
+        else:
+            raise ValueError("Unsupported file format")
+    
+    def _frame_rows(self, df):
+        """Rows of a header-less frame as lists, with NaN as None"""
+        return df.astype(object).where(df.notna(), None).values.tolist()
+    
+    def _scan_layout(self, rows):
+        """Find the table header in one pass over the scanned rows, collecting the metadata above it.
+        
+        Returns (header_row, header, metadata); the header row is the first one that maps like a
+        costing table, else the first non-empty row without a "Label: value" metadata cell.
+        """
+        header_row = None
+        first_plain_row = None
+        found = []
+        
+        for idx, row in enumerate(rows):
+            if all(value is None for value in row):
+                continue
+            
+            if self._is_costing_header(column_resolver.probe(self._normalize_columns(self._make_header(row)))):
+                header_row = idx
+                break
+            
+            found.append((idx, self._read_metadata(row)))
+            # A header may itself read "Manufacturer" then another label, so only the colon form rules a row out
+            if first_plain_row is None and not self._has_labelled_cell(row):
+                first_plain_row = idx
+        
+        if header_row is None:
+            # Data rows can be wider than their header (trailing remarks), so width says nothing
+            header_row = first_plain_row
+        if header_row is None:
+            return None, None, {}
+        
+        # Earlier labels win, and nothing below the header counts as preamble
+        metadata = {}
+        for idx, values in found:
+            if idx < header_row:
+                for field, value in values.items():
+                    metadata.setdefault(field, value)
+        
+        return header_row, list(self._normalize_columns(self._make_header(rows[header_row]))), metadata
+    
+    def _read_metadata(self, row):
+        """Labelled values in a preamble row, as "Label: value" in one cell or "Label" then the value"""
+        values = {}
+        for idx, cell in enumerate(row):
+            if not isinstance(cell, str):
+                continue
+            
+            label, _, value = cell.partition(':')
+            field = METADATA_FIELDS.get(canonical_header(label))
+            if field is None or field in values:
+                continue
+            
+            value = value.strip()
+            if not value:
+                value = next((self._cell_text(v) for v in row[idx + 1:] if v is not None), '')
+            if value:
+                values[field] = value
+        return values
+    
+    def _has_labelled_cell(self, row):
+        """Whether a row holds a "Label: value" cell for one of the metadata labels"""
+        for cell in row:
+            if isinstance(cell, str):
+                label, _, value = cell.partition(':')
+                if value.strip() and canonical_header(label) in METADATA_FIELDS:
+                    return True
+        return False
+    
+    def _cell_text(self, value):
+        """Cell value as text, without the '.0' Excel adds to whole numbers"""
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value).strip()
+    
+    def _is_costing_header(self, mapped):
+        return 'material_name' in mapped and ('country_of_origin' in mapped or 'hs_code' in mapped)
+    
+    def _projection(self, columns, mapped_columns):
+        """Positions of the header columns to read, or None to read them all"""
+        wanted = set(mapped_columns.values()) | set(PASSTHROUGH_COLUMNS)
+        positions = [idx for idx, column in enumerate(columns) if column in wanted]
+        return positions or None
+    
+    def _read_batches(self, source, batch_size, sheet_name=None, usecols=None, header_row=0):
+        """Yield raw DataFrames for one sheet (the first by default), with the header_row as columns"""
+        file_ext = self._source_ext(source)
+        
+        if file_ext == '.xlsx':
+            if self.xlsx_engine == 'calamine':
+                df = self._read_calamine(source, sheet_name, usecols, header_row)
+                if df is not None:
+                    yield df
+                    return
+            # Stream rows so the workbook and its styles are never fully loaded
+            yield from self._read_xlsx_batches(source, batch_size, sheet_name, usecols, header_row)
+        elif file_ext == '.xls':
+            # Legacy workbooks are not supported by openpyxl
+            yield pd.read_excel(self._open_source(source), usecols=usecols, skiprows=header_row, dtype=object,
+                                sheet_name=sheet_name if sheet_name is not None else 0)
+        elif file_ext == '.csv':
+            yield self._read_csv(source, usecols, header_row)
+        else:
+            raise ValueError("Unsupported file format")
+    
+    def _read_csv(self, source, usecols=None, header_row=0):
+        """Read a CSV file with the configured engine, retrying with pandas' C parser on failure"""
+        if self.csv_engine == 'pyarrow':
+            try:
+                return self._read_csv_pyarrow(source, usecols, header_row)
+            except Exception as e:
+                logger.warning(f"pyarrow CSV engine failed on {source}, retrying with C engine: {str(e)}")
+        
+        # Every column is read as text, as the XLSX batches are: HS codes in a column with blanks
+        # must not become floats ("640610.0"), and _clean_data converts the cost columns itself
+        return pd.read_csv(self._open_source(source), usecols=usecols, skiprows=header_row, dtype=str)
+    
+    def _read_csv_pyarrow(self, source, usecols=None, header_row=0):
+        """Read the usecols positions of a CSV file as text with pyarrow's multi-threaded reader"""
+        # pandas' pyarrow engine neither takes usecols positions nor skips type inference,
+        # so the file goes to pyarrow directly and only the column names come from pandas
+        from pyarrow import csv as pa_csv, string
+        
+        header = pd.read_csv(self._open_source(source), skiprows=header_row, nrows=0).columns
+        positions = list(usecols) if usecols is not None else list(range(len(header)))
+        names = [f"f{idx}" for idx in positions]
+        table = pa_csv.read_csv(
+            self._open_source(source),
+            read_options=pa_csv.ReadOptions(skip_rows=header_row + 1, autogenerate_column_names=True),
+            convert_options=pa_csv.ConvertOptions(include_columns=names, strings_can_be_null=True,
+                                                  column_types={name: string() for name in names}),
+        )
+        df = table.to_pandas()
+        df.columns = [header[idx] for idx in positions]
+        # Nulls arrive as None; the C engine and _clean_data work with NaN
+        return df.where(df.notna(), np.nan)
+    
+    def _read_calamine(self, source, sheet_name=None, usecols=None, header_row=0):
+        """Read a whole worksheet with the Rust calamine reader, or None to fall back to openpyxl"""
+        try:
+            # Object dtype keeps cell values as-is, matching the openpyxl batches
+            return pd.read_excel(self._open_source(source), engine='calamine', dtype=object, usecols=usecols,
+                                 skiprows=header_row, sheet_name=sheet_name if sheet_name is not None else 0)
+        except Exception as e:
+            logger.warning(f"calamine failed on {source}, falling back to openpyxl: {str(e)}")
+            return None
+    
+    def _read_xlsx_batches(self, source, batch_size, sheet_name=None, usecols=None, header_row=0):
+        """Read a worksheet in read-only mode and yield fixed-size row batches of the usecols positions"""
+        wb = load_workbook(self._open_source(source), read_only=True, data_only=True)
+        try:
+            ws = wb[sheet_name] if sheet_name is not None else wb.worksheets[0]
+            rows = ws.iter_rows(values_only=True)
+            
+            # Rows above the header are the preamble, already read by _scan_layout
+            header_values = next(islice(rows, header_row, None), None)
+            if header_values is None:
+                return
+            header = self._make_header(header_values)
+            
+            width = len(header)
+            if usecols is not None:
+                header = [header[idx] for idx in usecols]
+            
+            batch = []
+            for row in rows:
+                if usecols is not None:
+                    row = tuple(row[idx] if idx < len(row) else None for idx in usecols)
+                else:
+                    row = tuple(row[:width]) + (None,) * (width - len(row))
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    yield self._batch_frame(batch, header)
+                    batch = []
+            
+            if batch:
+                yield self._batch_frame(batch, header)
+        finally:
+            wb.close()
+    
+    def _normalize_columns(self, columns):
+        """Clean column names (lowercase, replace spaces with underscores)"""
+        return pd.Index(columns).astype(str).str.lower().str.replace(' ', '_').str.replace('/', '_')
+    
+    def find_costing_sheets(self, source):
+        """Names of the sheets in a workbook whose header looks like a costing table"""
+        file_ext = self._source_ext(source)
+        headers = {}
+        
+        if file_ext == '.xlsx':
+            wb = load_workbook(self._open_source(source), read_only=True, data_only=True)
+            try:
+                for ws in wb.worksheets:
+                    rows = list(islice(ws.iter_rows(values_only=True), SCAN_ROWS))
+                    headers[ws.title] = self._scan_layout(rows)[1] or []
+            finally:
+                wb.close()
+        elif file_ext == '.xls':
+            sheets = pd.read_excel(self._open_source(source), sheet_name=None, header=None, nrows=SCAN_ROWS, dtype=object)
+            for name, df in sheets.items():
+                headers[name] = self._scan_layout(self._frame_rows(df))[1] or []
+        
+        costing_sheets = []
+        for name, header in headers.items():
+            if self._is_costing_header(self._match_columns(header)):
+                costing_sheets.append(name)
+        
+        logger.info(f"Costing sheets in {source}: {costing_sheets}")
+        return costing_sheets
+    
+    def _make_header(self, row):
+        """Column names for a header row, naming blanks and de-duplicating like pandas"""
+        header = []
+        seen = {}
+        for idx, value in enumerate(row):
+            name = f"Unnamed: {idx}" if value is None else str(value)
+            if name in seen:
+                seen[name] += 1
+                name = f"{name}.{seen[name]}"
+            else:
+                seen[name] = 0
+            header.append(name)
+        return header
+    
+    def _batch_frame(self, batch, header):
+        """Build an object-dtype frame from row tuples, with empty cells as NaN"""
+        # No per-batch dtype inference, so every batch converts the same way in _clean_data
+        df = pd.DataFrame(batch, columns=header, dtype=object)
+        return df.where(df.notna(), np.nan)
+    
+    def _map_columns(self, columns):
+        """Resolve the standardized columns for a sheet from its (cleaned) header"""
+        # Log available columns for debugging
+        logger.info(f"Available columns: {list(columns)}")
+        
+        mapped_columns = self._match_columns(columns)
+        logger.info(f"Mapped columns: {mapped_columns}")
+        
+        return mapped_columns
+    
+    def _match_columns(self, columns):
+        """Map standardized column names to the matching (cleaned) header names"""
+        return column_resolver.resolve(columns)
+    
+    def _clean_data(self, df):
+        """Clean and validate the dataframe"""
+        # Remove completely empty rows
+        df = df.dropna(how='all')
+        
+        # Convert numeric columns
+        numeric_columns = ['cost_per_pair', 'fob_with_tooling']
+        for col in numeric_columns:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        
+        # Clean string columns
+        string_columns = ['manufacturer', 'country_of_origin', 'hs_code', 'material_name']
+        for col in string_columns:
+            if col in df.columns:
+                df[col] = df[col].astype(str).str.strip()
+        
+        # Remove rows where all important columns are NaN
+        important_cols = [col for col in ['material_name', 'country_of_origin'] if col in df.columns]
+        if important_cols:
+            df = df.dropna(subset=important_cols, how='all')
+        
+        return df
+    
+    def _compact_dtypes(self, df):
+        """Store the repetitive country and HS code columns as categoricals"""
+        for col in CATEGORICAL_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+        return df
+
+
+def parse_sheet(source, sheet_name, csv_engine=None, xlsx_engine=None):
+    """Process-pool entry point for parsing one sheet of a workbook"""
+    parser = SheetParser(csv_engine=csv_engine, xlsx_engine=xlsx_engine)
+    return parser.process_frame(source, sheet_name=sheet_name)